@@ -1,93 +1,2171 @@
-from flask import Flask, request, jsonify, send_from_directory  
-from pyvrp import Model
-from pyvrp.stop import MaxRuntime
+from flask import Flask, Response, request, jsonify, send_from_directory  
+from pyvrp import (
+    Client, Depot, GeneticAlgorithm, PenaltyManager, Population, ProblemData,
+    RandomNumberGenerator, Solution, SolveParams, VehicleType, solve as solve_problem
+)
+from pyvrp.crossover import ordered_crossover, selective_route_exchange
+from pyvrp.diversity import broken_pairs_distance
+from pyvrp.search import LocalSearch, compute_neighbours
+from pyvrp.stop import MaxIterations, MaxRuntime, MultipleCriteria, NoImprovement
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask_cors import CORS
+from collections import Counter, OrderedDict, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+import atexit
+import contextvars
+import cProfile
+import hashlib
+import heapq
+import json
+import logging
 import os
 import math
+import multiprocessing
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
 
 app = Flask(__name__)
 CORS(app)
 
+# Registro estructurado: una línea JSON por evento con el id de la petición
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_MATRIX_SAMPLE_RATE = float(os.environ.get("LOG_MATRIX_SAMPLE_RATE", 0.05))  # en nivel DEBUG
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como JSON: hora, nivel, mensaje, request_id y campos extra"""
+
+    STANDARD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", None)
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in self.STANDARD_FIELDS)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+logger = logging.getLogger("vrp")
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+if not logger.handlers:
+    _log_handler = logging.StreamHandler(sys.stderr)
+    _log_handler.setFormatter(JsonFormatter())
+    logger.addHandler(_log_handler)
+logger.addFilter(RequestIdFilter())
+
+
+def in_context(fn):
+    """Envuelve fn para ejecutarla en otro hilo con el contexto actual (request_id)"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+class Metric:
+    """Métrica en el formato de texto de Prometheus, con etiquetas opcionales"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+    def render(self):
+        with self._lock:
+            items = [(key, self._copy(value)) for key, value in self._values.items()]
+        if not items and not self.labels:
+            items = [((), self._initial())]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(items):
+            lines += self._samples(key, value)
+        return lines
+
+    def _initial(self):
+        return 0
+
+    def _copy(self, value):
+        return value
+
+    def _samples(self, key, value):
+        return [f"{self.name}{self._labels(key)} {value}"]
+
+
+class CounterMetric(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class GaugeMetric(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Suma 1 mientras dura el bloque (también sirve como decorador)"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class HistogramMetric(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=None):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets or (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                                         1, 2.5, 5, 10, 30, 60, 120, 300))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _initial(self):
+        return ([0] * len(self.buckets), 0.0, 0)
+
+    def _copy(self, value):
+        counts, total, count = value
+        return (list(counts), total, count)
+
+    def _samples(self, key, value):
+        counts, total, count = value
+        lines = [f"{self.name}_bucket{self._labels(key, [('le', bound)])} {n}"
+                 for bound, n in zip(self.buckets, counts)]
+        lines.append(f"{self.name}_bucket{self._labels(key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{self._labels(key)} {total}")
+        lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+metrics_registry = []
+
+STAGE_SECONDS = HistogramMetric(
+    "vrp_stage_duration_seconds",
+    "Duración de cada etapa de /solve (matrix, build, search, geometry, serialization)",
+    labels=["stage"])
+OSRM_FAILURES = CounterMetric(
+    "vrp_osrm_failures_total",
+    "Consultas al motor de rutas fallidas (error) o rechazadas con el circuito abierto",
+    labels=["service", "reason"])
+MATRIX_FALLBACKS = CounterMetric(
+    "vrp_matrix_fallback_total", "Matrices calculadas con el respaldo haversine")
+SOLVE_OUTCOMES = CounterMetric(
+    "vrp_solve_outcomes_total",
+    "Resultados de /solve: feasible, infeasible, cached, cancelled o error",
+    labels=["outcome"])
+FLEET_RETRIES = CounterMetric(
+    "vrp_fleet_retries_total",
+    "Soluciones con optimal_vehicles + 1 por infactibilidad (mode: retry secuencial o race)",
+    labels=["mode"])
+SOLVES_IN_PROGRESS = GaugeMetric(
+    "vrp_solves_in_progress", "Resoluciones en curso (peticiones y trabajos)")
+
+
+class SolveTimings:
+    """Desglose de tiempos de una resolución para la sección timings de /solve"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.search = []
+        self.routing_calls = Counter()
+        self.matrix_cache_hits = 0
+        self.matrix_cache_misses = 0
+        self.matrix_fallback = False
+        self.solution_cache_hit = False
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            if name == "search":
+                self.search.append(seconds)
+            else:
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count_call(self, service):
+        with self._lock:
+            self.routing_calls[service] += 1
+
+    def to_dict(self):
+        ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+        with self._lock:
+            return {
+                "matrix_ms": ms(self.stages.get("matrix")),
+                "matrix_cache_hits": self.matrix_cache_hits,
+                "matrix_cache_misses": self.matrix_cache_misses,
+                "matrix_fallback": self.matrix_fallback,
+                "solution_cache_hit": self.solution_cache_hit,
+                "build_ms": ms(self.stages.get("build")),
+                "solve_ms": [ms(seconds) for seconds in self.search],
+                "geometry_ms": ms(self.stages.get("geometry")),
+                "serialization_ms": None,
+                "osrm_calls": {
+                    "table": self.routing_calls["table"],
+                    "route": self.routing_calls["route"],
+                    "total": sum(self.routing_calls.values())
+                },
+                "total_ms": ms(time.perf_counter() - self.start)
+            }
+
+
+# Tiempos de la resolución en curso (None si la petición no pidió timings)
+solve_timings_var = contextvars.ContextVar("solve_timings", default=None)
+
+
+@contextmanager
+def stage(name):
+    """Mide una etapa de /solve en vrp_stage_duration_seconds y en los timings de la petición"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = solve_timings_var.get()
+        if timings is not None:
+            timings.add_stage(name, elapsed)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    lines = [line for metric in metrics_registry for line in metric.render()]
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+@app.before_request
+def assign_request_id():
+    request_id_var.set(request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16])
+
+
+@app.after_request
+def add_request_id_header(response):
+    response.headers["X-Request-ID"] = request_id_var.get() or ""
+    return response
+
 # Ruta para servir la página principal
 @app.route('/')
 def serve_index():
     return send_from_directory(os.path.dirname(__file__), 'vrp_app.html')
 
-OSRM_URL = "http://router.project-osrm.org/table/v1/driving/"
+# Motor de rutas: "osrm" (servidor en OSRM_BASE_URL) o "local" (grafo de ROAD_NETWORK_FILE)
+ROUTING_BACKEND = os.environ.get("ROUTING_BACKEND", "osrm")
+OSRM_BASE_URL = os.environ.get("OSRM_BASE_URL", "http://router.project-osrm.org").rstrip("/")
+OSRM_PROFILE = os.environ.get("OSRM_PROFILE", "driving")
+ROAD_NETWORK_FILE = os.environ.get("ROAD_NETWORK_FILE")  # GeoJSON de tramos viales
+LOCAL_ROUTER_SPEED_KMH = float(os.environ.get("LOCAL_ROUTER_SPEED_KMH", 40))  # tramos sin velocidad
+# Máximo de puntos por llamada route (2 = una llamada por tramo)
+OSRM_ROUTE_MAX_WAYPOINTS = int(os.environ.get("OSRM_ROUTE_MAX_WAYPOINTS", 100))
+
+# Costo que PyVRP informa mientras la mejor solución no es factible
+INFEASIBLE_COST = np.iinfo(np.int64).max
+
+# Máximo de búsquedas en paralelo (procesos) por petición con parallel_seeds
+MAX_PARALLEL_SEEDS = int(os.environ.get("MAX_PARALLEL_SEEDS", os.cpu_count() or 1))
+
+# Criterio de parada adaptativo: tiempo según número de clientes + convergencia
+STOP_RUNTIME_PER_CLIENT = float(os.environ.get("STOP_RUNTIME_PER_CLIENT", 0.2))
+STOP_MIN_RUNTIME = float(os.environ.get("STOP_MIN_RUNTIME", 2))
+STOP_MAX_RUNTIME = float(os.environ.get("STOP_MAX_RUNTIME", 30))
+STOP_RUNTIME_LIMIT = float(os.environ.get("STOP_RUNTIME_LIMIT", 300))  # tope para max_runtime pedido
+STOP_NO_IMPROVEMENT = int(os.environ.get("STOP_NO_IMPROVEMENT", 2000))
+
+# Caché de soluciones completas de /solve
+SOLUTION_CACHE_MAX_ENTRIES = int(os.environ.get("SOLUTION_CACHE_MAX_ENTRIES", 256))
+SOLUTION_CACHE_TTL = float(os.environ.get("SOLUTION_CACHE_TTL", 900))  # segundos
+
+# Descomposición en clusters para instancias muy grandes
+DECOMPOSITION_CLUSTER_SIZE = int(os.environ.get("DECOMPOSITION_CLUSTER_SIZE", 150))
+DECOMPOSITION_BOUNDARY_ROUTES = int(os.environ.get("DECOMPOSITION_BOUNDARY_ROUTES", 2))  # por lado
+
+# Re-optimización tras cambios pequeños: búsqueda más corta que la completa
+REOPT_RUNTIME_FACTOR = float(os.environ.get("REOPT_RUNTIME_FACTOR", 0.25))
+REOPT_NO_IMPROVEMENT = int(os.environ.get("REOPT_NO_IMPROVEMENT", 500))
+
+# Carrera flota óptima / óptima + 1 (también activable por petición con race_fleets)
+RACE_FLEETS = os.environ.get("RACE_FLEETS", "0") == "1"
+
+# Matriz de respaldo (haversine) cuando OSRM no responde
+EARTH_RADIUS_M = 6371000
+FALLBACK_SPEED_KMH = float(os.environ.get("FALLBACK_SPEED_KMH", 50))
+FALLBACK_DETOUR_FACTOR = float(os.environ.get("FALLBACK_DETOUR_FACTOR", 1.3))
+
+# Matriz dispersa para instancias enormes: OSRM solo para los k vecinos de cada punto
+SPARSE_MATRIX_THRESHOLD = int(os.environ.get("SPARSE_MATRIX_THRESHOLD", 2000))  # puntos; 0 = nunca
+SPARSE_MATRIX_NEIGHBOURS = int(os.environ.get("SPARSE_MATRIX_NEIGHBOURS", 30))
+
+# Sesiones de planificación con matrices incrementales
+MATRIX_SESSION_TTL = float(os.environ.get("MATRIX_SESSION_TTL", 3600))  # segundos sin uso
+MATRIX_SESSION_MAX = int(os.environ.get("MATRIX_SESSION_MAX", 100))
+
+# Geometría: consultas en paralelo con un pool de conexiones compartido
+GEOMETRY_MAX_WORKERS = int(os.environ.get("GEOMETRY_MAX_WORKERS", 8))
+GEOMETRY_DEADLINE = float(os.environ.get("GEOMETRY_DEADLINE", 20))
+
+# Cliente HTTP de OSRM: timeouts por servicio, reintentos y cortocircuito
+OSRM_POOL_SIZE = int(os.environ.get("OSRM_POOL_SIZE", 16))  # conexiones reutilizables por host
+OSRM_CONNECT_TIMEOUT = float(os.environ.get("OSRM_CONNECT_TIMEOUT", 3))
+OSRM_TABLE_TIMEOUT = float(os.environ.get("OSRM_TABLE_TIMEOUT", 30))
+OSRM_ROUTE_TIMEOUT = float(os.environ.get("OSRM_ROUTE_TIMEOUT", 15))
+OSRM_RETRIES = int(os.environ.get("OSRM_RETRIES", 2))
+OSRM_RETRY_BACKOFF = float(os.environ.get("OSRM_RETRY_BACKOFF", 0.3))  # segundos, se duplica
+OSRM_BREAKER_THRESHOLD = int(os.environ.get("OSRM_BREAKER_THRESHOLD", 3))  # fallos seguidos
+OSRM_BREAKER_RESET = float(os.environ.get("OSRM_BREAKER_RESET", 30))  # segundos abierto
+
+# Teselado de la matriz para instancias mayores al límite de coordenadas de OSRM
+OSRM_TABLE_BLOCK_SIZE = int(os.environ.get("OSRM_TABLE_BLOCK_SIZE", 50))
+OSRM_TABLE_MAX_WORKERS = int(os.environ.get("OSRM_TABLE_MAX_WORKERS", 4))
+
+# Caché de pares origen-destino (persistente entre peticiones)
+MATRIX_CACHE_MAX_PAIRS = int(os.environ.get("MATRIX_CACHE_MAX_PAIRS", 500000))
+MATRIX_CACHE_PRECISION = 5  # decimales de lon/lat (~1 m)
+MATRIX_CACHE_FILE = os.environ.get("MATRIX_CACHE_FILE")
+MATRIX_CACHE_SAVE_INTERVAL = float(os.environ.get("MATRIX_CACHE_SAVE_INTERVAL", 300))  # s
+
+
+class MatrixCache:
+    """
+    Caché LRU de distancias y duraciones OSRM por par de coordenadas.
+    La clave es (perfil, origen, destino) con lon/lat redondeados.
+    """
+
+    def __init__(self, max_pairs=MATRIX_CACHE_MAX_PAIRS, precision=MATRIX_CACHE_PRECISION):
+        self.max_pairs = max_pairs
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self._pairs = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def key(self, coord):
+        return (round(coord[0], self.precision), round(coord[1], self.precision))
+
+    def lookup(self, profile, keys, distances, durations):
+        """Rellena las celdas conocidas y devuelve las celdas faltantes (i, j)"""
+        missing = []
+        hits = 0
+        with self._lock:
+            for i, frm in enumerate(keys):
+                for j, to in enumerate(keys):
+                    if frm == to:
+                        continue
+                    cell = self._pairs.get((profile, frm, to))
+                    if cell is None:
+                        missing.append((i, j))
+                        continue
+                    self._pairs.move_to_end((profile, frm, to))
+                    distances[i][j], durations[i][j] = cell
+                    hits += 1
+            self.hits += hits
+            self.misses += len(missing)
+        return missing
+
+    def store(self, profile, cells):
+        """Guarda celdas [(origen, destino, distancia, duración)] con desalojo LRU"""
+        with self._lock:
+            for frm, to, distance, duration in cells:
+                if frm == to or distance is None or duration is None:
+                    continue
+                self._pairs[(profile, frm, to)] = (distance, duration)
+                self._pairs.move_to_end((profile, frm, to))
+                self._dirty = True
+            while len(self._pairs) > self.max_pairs:
+                self._pairs.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "pairs": len(self._pairs),
+                "max_pairs": self.max_pairs,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0
+            }
+
+    def save(self, path):
+        """
+        Guarda la caché en path de forma atómica (archivo temporal +
+        os.replace). Las celdas que ya estaban en el archivo (p. ej. de otro
+        worker) se conservan como las menos recientes.
+        """
+        with self._lock:
+            rows = [[profile, list(frm), list(to), dist, dur]
+                    for (profile, frm, to), (dist, dur) in self._pairs.items()]
+            self._dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path) as fh:
+                    ours = {(r[0], tuple(r[1]), tuple(r[2])) for r in rows}
+                    rows = [r for r in json.load(fh)
+                            if (r[0], tuple(r[1]), tuple(r[2])) not in ours] + rows
+            except Exception as e:
+                logger.warning("No se pudo combinar la caché de matrices guardada: %s", e)
+        rows = rows[-self.max_pairs:]
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                        prefix=".matrix-cache-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fh:
+                json.dump(rows, fh)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def save_if_dirty(self, path):
+        """Guarda solo si hubo celdas nuevas desde el último guardado"""
+        with self._lock:
+            dirty = self._dirty
+        if dirty:
+            self.save(path)
+
+    def load(self, path):
+        with open(path) as fh:
+            rows = json.load(fh)
+        with self._lock:
+            for profile, frm, to, dist, dur in rows:
+                self._pairs[(profile, tuple(frm), tuple(to))] = (dist, dur)
+            while len(self._pairs) > self.max_pairs:
+                self._pairs.popitem(last=False)
+
+
+matrix_cache = MatrixCache()
+
+if MATRIX_CACHE_FILE:
+    if os.path.exists(MATRIX_CACHE_FILE):
+        try:
+            matrix_cache.load(MATRIX_CACHE_FILE)
+        except Exception as e:
+            logger.warning("No se pudo cargar la caché de matrices: %s", e)
+
+    def save_matrix_cache_periodically():
+        """Guardado periódico: un crash o SIGKILL solo pierde el último intervalo"""
+        while True:
+            time.sleep(MATRIX_CACHE_SAVE_INTERVAL)
+            try:
+                matrix_cache.save_if_dirty(MATRIX_CACHE_FILE)
+            except Exception as e:
+                logger.warning("No se pudo guardar la caché de matrices: %s", e)
+
+    if MATRIX_CACHE_SAVE_INTERVAL > 0:
+        threading.Thread(target=save_matrix_cache_periodically, name="matrix-cache-saver",
+                         daemon=True).start()
+    atexit.register(lambda: matrix_cache.save_if_dirty(MATRIX_CACHE_FILE))
+
+
+@app.route("/cache/matrix", methods=["GET"])
+def matrix_cache_stats():
+    return jsonify(matrix_cache.stats())
+
+
+class OsrmUnavailable(Exception):
+    """OSRM marcado como caído: se usa el respaldo local sin esperar timeouts"""
+
+
+class OsrmClient:
+    """
+    Cliente HTTP compartido entre hilos para OSRM. Reutiliza conexiones
+    (keep-alive), aplica un timeout por servicio y reintenta con espera
+    exponencial los errores de red y las respuestas 429/5xx. Tras
+    breaker_threshold fallos seguidos el circuito se abre y las consultas
+    fallan al instante durante breaker_reset segundos; después se deja
+    pasar una consulta de prueba que lo cierra si responde.
+    """
+
+    def __init__(self, pool_size=None, connect_timeout=None, timeouts=None, retries=None,
+                 backoff=None, breaker_threshold=None, breaker_reset=None):
+        self.connect_timeout = connect_timeout or OSRM_CONNECT_TIMEOUT
+        self.timeouts = timeouts or {"table": OSRM_TABLE_TIMEOUT, "route": OSRM_ROUTE_TIMEOUT}
+        self.breaker_threshold = breaker_threshold or OSRM_BREAKER_THRESHOLD
+        self.breaker_reset = OSRM_BREAKER_RESET if breaker_reset is None else breaker_reset
+
+        retry = Retry(
+            total=OSRM_RETRIES if retries is None else retries,
+            read=0,  # un timeout de lectura no se reintenta: multiplicaría la espera
+            backoff_factor=OSRM_RETRY_BACKOFF if backoff is None else backoff,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"]
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size or OSRM_POOL_SIZE,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+
+    def get(self, service, url):
+        """GET a un servicio de OSRM ("table" o "route"); devuelve el JSON"""
+        try:
+            self._before_request()
+        except OsrmUnavailable:
+            OSRM_FAILURES.inc(service=service, reason="circuit_open")
+            raise
+        try:
+            res = self.session.get(url, timeout=(self.connect_timeout, self.timeouts[service]))
+            if res.status_code >= 500:
+                res.raise_for_status()
+            data = res.json()
+        except (requests.RequestException, ValueError):
+            OSRM_FAILURES.inc(service=service, reason="error")
+            self._record(False)
+            raise
+        # Un 4xx es un problema de la consulta, no del servidor
+        self._record(True)
+        if res.status_code >= 400:
+            res.raise_for_status()
+        return data
+
+    def _before_request(self):
+        with self._lock:
+            self.requests += 1
+            if self._opened_at is None:
+                return
+            if self._probing or time.time() - self._opened_at < self.breaker_reset:
+                self.rejected += 1
+                raise OsrmUnavailable("Circuito de OSRM abierto: se usa el respaldo local")
+            self._probing = True
+
+    def _record(self, ok):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self.errors += 1
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.breaker_threshold:
+                if self._opened_at is None:
+                    logger.warning("OSRM: %d fallos seguidos, circuito abierto por %ss",
+                                   self._failures, self.breaker_reset)
+                self._opened_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            if self._opened_at is None:
+                state = "closed"
+            elif self._probing or time.time() - self._opened_at < self.breaker_reset:
+                state = "open"
+            else:
+                state = "half-open"
+            return {
+                "circuit": state,
+                "consecutive_failures": self._failures,
+                "requests": self.requests,
+                "errors": self.errors,
+                "rejected": self.rejected
+            }
+
+
+osrm_client = OsrmClient()
+
+
+@app.route("/osrm", methods=["GET"])
+def osrm_status():
+    return jsonify(osrm_client.stats())
+
+
+def haversine_distance(a, b):
+    """Distancia en metros entre dos puntos (lon, lat)"""
+    lon1, lat1, lon2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, h)))
+
+
+class OsrmBackend:
+    """Motor de rutas OSRM (público o propio) a través del cliente compartido"""
+
+    def __init__(self, base_url=None, profile=None, client=None):
+        self.base_url = (base_url or OSRM_BASE_URL).rstrip("/")
+        self.profile = profile or OSRM_PROFILE
+        self.client = client or osrm_client
+
+    def table(self, coords, sources=None, destinations=None):
+        coords_str = ";".join([f"{lon},{lat}" for lon, lat in coords])
+        url = f"{self.base_url}/table/v1/{self.profile}/{coords_str}?annotations=distance,duration"
+        if sources is not None:
+            url += "&sources=" + ";".join(str(i) for i in sources)
+        if destinations is not None:
+            url += "&destinations=" + ";".join(str(j) for j in destinations)
+        logger.debug("Consultando OSRM: %s", url)
+
+        data = self.client.get("table", url)
+        return data["distances"], data["durations"]
+
+    def route(self, points):
+        coords_str = ";".join(f"{p[0]},{p[1]}" for p in points)
+        url = f"{self.base_url}/route/v1/{self.profile}/{coords_str}?overview=full&geometries=geojson"
+        res = self.client.get("route", url)
+        if res.get("routes"):
+            return res["routes"][0]["geometry"]["coordinates"]
+        return None
+
+
+def parse_speed_kmh(value):
+    """Velocidad en km/h de un tag speed_kmh/maxspeed ("50", "50 km/h", "30 mph"); None si no se entiende"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value) if value > 0 else None
+    match = re.match(r"\s*(\d+(?:\.\d+)?)\s*(km/h|kmh|kph|mph)?\s*$", str(value or ""), re.I)
+    if not match or float(match.group(1)) <= 0:
+        return None
+    speed = float(match.group(1))
+    return speed * 1.609344 if (match.group(2) or "").lower() == "mph" else speed
+
+
+class LocalRouter:
+    """
+    Motor de rutas local, sin red: caminos mínimos en tiempo (Dijkstra) sobre
+    una red vial GeoJSON de LineString/MultiLineString. Los vértices
+    compartidos unen los tramos; cada feature puede indicar speed_kmh (o
+    maxspeed) y oneway. Cada punto se ajusta al nodo más cercano y ese
+    tramo de ajuste se suma en línea recta.
+    """
+
+    def __init__(self, path, speed_kmh=None):
+        self.profile = f"local:{os.path.basename(path)}"
+        self.speed = (speed_kmh or LOCAL_ROUTER_SPEED_KMH) / 3.6  # m/s
+        with open(path) as fh:
+            network = json.load(fh)
+
+        index, nodes, self.adjacency = {}, [], []
+
+        def node(point):
+            key = (round(point[0], 6), round(point[1], 6))
+            if key not in index:
+                index[key] = len(nodes)
+                nodes.append(key)
+                self.adjacency.append([])
+            return index[key]
+
+        for feature in network.get("features", []):
+            geometry = feature.get("geometry") or {}
+            props = feature.get("properties") or {}
+            if geometry.get("type") == "LineString":
+                lines = [geometry["coordinates"]]
+            elif geometry.get("type") == "MultiLineString":
+                lines = geometry["coordinates"]
+            else:
+                continue
+            speed_kmh = parse_speed_kmh(props.get("speed_kmh")) or parse_speed_kmh(props.get("maxspeed"))
+            speed = speed_kmh / 3.6 if speed_kmh else self.speed
+            oneway = props.get("oneway") in (True, 1, "yes", "true", "1")
+            for line in lines:
+                ids = [node(point) for point in line]
+                for a, b in zip(ids, ids[1:]):
+                    if a == b:
+                        continue
+                    length = haversine_distance(nodes[a], nodes[b])
+                    self.adjacency[a].append((b, length, length / speed))
+                    if not oneway:
+                        self.adjacency[b].append((a, length, length / speed))
+
+        if not nodes:
+            raise ValueError(f"La red vial {path} no tiene tramos LineString")
+        self.nodes = nodes
+        self.points = np.asarray(nodes, dtype=np.float64)
+        self._scale = math.cos(math.radians(self.points[:, 1].mean()))
+        logger.info("Red vial local: %d nodos desde %s", len(nodes), path)
+
+    def snap(self, coord):
+        """Nodo más cercano a coord y distancia (m) hasta él"""
+        dx = (self.points[:, 0] - coord[0]) * self._scale
+        dy = self.points[:, 1] - coord[1]
+        nearest = int(np.argmin(dx * dx + dy * dy))
+        return nearest, haversine_distance(coord, self.nodes[nearest])
+
+    def shortest_paths(self, source, targets):
+        """Dijkstra desde source hasta alcanzar targets: {nodo: (metros, segundos)} y predecesores"""
+        best = {source: (0.0, 0.0)}
+        previous = {}
+        remaining = set(targets)
+        settled = set()
+        heap = [(0.0, 0.0, source)]
+        while heap and remaining:
+            duration, length, current = heapq.heappop(heap)
+            if current in settled:
+                continue
+            settled.add(current)
+            remaining.discard(current)
+            for nxt, edge_length, edge_duration in self.adjacency[current]:
+                candidate = duration + edge_duration
+                if nxt not in best or candidate < best[nxt][1]:
+                    best[nxt] = (length + edge_length, candidate)
+                    previous[nxt] = current
+                    heapq.heappush(heap, (candidate, length + edge_length, nxt))
+        return {t: best[t] for t in targets if t in settled}, previous
+
+    def table(self, coords, sources=None, destinations=None):
+        sources = range(len(coords)) if sources is None else sources
+        destinations = range(len(coords)) if destinations is None else destinations
+        snapped = [self.snap(c) for c in coords]
+        targets = {snapped[j][0] for j in destinations}
+
+        distances, durations = [], []
+        unreachable = 0
+        for i in sources:
+            origin, origin_gap = snapped[i]
+            reached, _ = self.shortest_paths(origin, targets)
+            dist_row, dur_row = [], []
+            for j in destinations:
+                if i == j:
+                    dist_row.append(0)
+                    dur_row.append(0)
+                    continue
+                target, target_gap = snapped[j]
+                if target not in reached:
+                    # Componentes sin conexión: línea recta a la velocidad por defecto
+                    unreachable += 1
+                    straight = haversine_distance(coords[i], coords[j])
+                    dist_row.append(straight)
+                    dur_row.append(straight / self.speed)
+                    continue
+                length, duration = reached[target]
+                gap = origin_gap + target_gap
+                dist_row.append(length + gap)
+                dur_row.append(duration + gap / self.speed)
+            distances.append(dist_row)
+            durations.append(dur_row)
+        if unreachable:
+            logger.warning("Red vial local: %d pares sin camino, se estiman en línea recta", unreachable)
+        return distances, durations
+
+    def route(self, points):
+        geometry = [list(points[0])]
+        for a, b in zip(points, points[1:]):
+            origin, _ = self.snap(a)
+            target, _ = self.snap(b)
+            reached, previous = self.shortest_paths(origin, [target])
+            path = []
+            if target in reached:
+                node = target
+                while node != origin:
+                    path.append(node)
+                    node = previous[node]
+                path.append(origin)
+            geometry += [list(self.nodes[n]) for n in reversed(path)] + [list(b)]
+        return geometry
+
+
+def make_routing_backend(name=None):
+    """Motor de rutas configurado (ROUTING_BACKEND)"""
+    name = name or ROUTING_BACKEND
+    if name == "osrm":
+        return OsrmBackend()
+    if name == "local":
+        if not ROAD_NETWORK_FILE:
+            raise ValueError("ROUTING_BACKEND=local requiere ROAD_NETWORK_FILE")
+        return LocalRouter(ROAD_NETWORK_FILE)
+    raise ValueError(f"Motor de rutas desconocido: {name}")
+
+
+routing_backend = make_routing_backend()
+
+
+def osrm_table(coords, sources=None, destinations=None):
+    """
+    Consulta la tabla de distancias y duraciones al motor de rutas. Con
+    sources/destinations (índices sobre coords) devuelve solo el bloque
+    filas x columnas pedido.
+    """
+    timings = solve_timings_var.get()
+    if timings is not None:
+        timings.count_call("table")
+    return routing_backend.table(coords, sources, destinations)
+
+
+def osrm_block(coords, rows, cols):
+    """
+    Consulta a OSRM solo el bloque rows x cols (índices sobre coords).
+    Si el bloque supera el límite de coordenadas del servidor se divide en
+    teselas de OSRM_TABLE_BLOCK_SIZE filas x columnas que se piden en paralelo.
+    """
+    nodes = sorted(set(rows) | set(cols))
+    if len(nodes) > 2 * OSRM_TABLE_BLOCK_SIZE:
+        return osrm_tiled(coords, rows, cols)
+
+    position = {node: pos for pos, node in enumerate(nodes)}
+    return osrm_table(
+        [coords[node] for node in nodes],
+        sources=[position[i] for i in rows] if len(rows) < len(nodes) else None,
+        destinations=[position[j] for j in cols] if len(cols) < len(nodes) else None
+    )
+
+
+def osrm_tiled(coords, rows, cols, block_size=None, max_workers=None):
+    """Divide rows x cols en teselas, las consulta en paralelo y las une en una matriz"""
+    block_size = block_size or OSRM_TABLE_BLOCK_SIZE
+    max_workers = max_workers or OSRM_TABLE_MAX_WORKERS
+    row_starts = range(0, len(rows), block_size)
+    col_starts = range(0, len(cols), block_size)
+    logger.info("OSRM por teselas: %dx%d bloques de %d, %d en paralelo",
+                len(row_starts), len(col_starts), block_size, max_workers)
+
+    distances = [[None] * len(cols) for _ in rows]
+    durations = [[None] * len(cols) for _ in rows]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(in_context(osrm_block), coords,
+                        rows[r0:r0 + block_size], cols[c0:c0 + block_size]): (r0, c0)
+            for r0 in row_starts for c0 in col_starts
+        }
+        for future in as_completed(futures):
+            r0, c0 = futures[future]
+            tile_dist, tile_dur = future.result()
+            for a, (dist_row, dur_row) in enumerate(zip(tile_dist, tile_dur)):
+                distances[r0 + a][c0:c0 + len(dist_row)] = dist_row
+                durations[r0 + a][c0:c0 + len(dur_row)] = dur_row
+
+    return distances, durations
+
+
+def missing_blocks(keys, missing):
+    """
+    Agrupa las celdas faltantes en bloques (filas, columnas) para OSRM.
+    Los puntos nunca vistos piden su fila y columna completas; los pares
+    sueltos entre puntos conocidos se agrupan en un único bloque.
+    """
+    size = len(keys)
+    row_missing = Counter(i for i, _ in missing)
+    key_count = Counter(keys)
+    new = [i for i in range(size) if row_missing[i] == size - key_count[keys[i]]]
+
+    if len(new) == size:
+        return [(list(range(size)), list(range(size)))]
+
+    blocks = []
+    if new:
+        new_set = set(new)
+        known = [i for i in range(size) if i not in new_set]
+        blocks.append((new, list(range(size))))
+        blocks.append((known, new))
+        missing = [(i, j) for i, j in missing if i not in new_set and j not in new_set]
+    if missing:
+        blocks.append((sorted({i for i, _ in missing}), sorted({j for _, j in missing})))
+    return blocks
+
+
+def get_matrices(coords, neighbours=None):
+    """
+    Consulta OSRM para obtener matriz de distancias y tiempos. Con neighbours
+    (por defecto en instancias de más de SPARSE_MATRIX_THRESHOLD puntos) solo
+    se piden los k vecinos más cercanos de cada punto; ver sparse_matrices.
+    Devuelve (distancias, duraciones, respaldo), con respaldo=True si se
+    usó la estimación haversine por un fallo del motor de rutas.
+    """
+    if neighbours is None:
+        large = SPARSE_MATRIX_THRESHOLD and len(coords) > SPARSE_MATRIX_THRESHOLD
+        neighbours = SPARSE_MATRIX_NEIGHBOURS if large else 0
+    try:
+        if neighbours and neighbours < len(coords) - 1:
+            distances, durations, info = sparse_matrices(coords, neighbours)
+            logger.info("Matriz dispersa", extra={"sparse_matrix": info})
+            return distances, durations, False
+
+        size = len(coords)
+        keys = [matrix_cache.key(c) for c in coords]
+        distances = [[0] * size for _ in range(size)]
+        durations = [[0] * size for _ in range(size)]
+
+        missing = matrix_cache.lookup(routing_backend.profile, keys, distances, durations)
+        timings = solve_timings_var.get()
+        if timings is not None:
+            timings.matrix_cache_misses += len(missing)
+            timings.matrix_cache_hits += size * (size - 1) - len(missing)
+        if missing:
+            logger.info("Caché de matrices: %d celdas faltantes", len(missing))
+            for rows, cols in missing_blocks(keys, missing):
+                block_dist, block_dur = osrm_block(coords, rows, cols)
+                cells = []
+                for a, i in enumerate(rows):
+                    for b, j in enumerate(cols):
+                        if i != j:
+                            distances[i][j] = block_dist[a][b]
+                            durations[i][j] = block_dur[a][b]
+                            cells.append((keys[i], keys[j], block_dist[a][b], block_dur[a][b]))
+                matrix_cache.store(routing_backend.profile, cells)
+
+        # Pares sin ruta (null de OSRM): estimación haversine en lugar de NaN
+        distances, durations = fill_unroutable(coords, distances, durations)
+
+        # Volcado de matrices solo en DEBUG y en una muestra de las peticiones
+        if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_MATRIX_SAMPLE_RATE:
+            logger.debug("Matrices de distancias y duraciones",
+                         extra={"distances": distances.tolist(), "durations": durations.tolist()})
+
+        return distances.tolist(), durations.tolist(), False
+    except Exception as e:
+        logger.warning("Error en OSRM, se usa el respaldo haversine: %s", e)
+        MATRIX_FALLBACKS.inc()
+        timings = solve_timings_var.get()
+        if timings is not None:
+            timings.matrix_fallback = True
+        # Crear matriz de distancia haversine como fallback.
+        distances, durations = haversine_matrices(coords)
+        return distances.tolist(), durations.tolist(), True
+
+
+def haversine_matrices(coords, speed_kmh=None, detour_factor=None):
+    """
+    Matrices n x n de distancias (m) y duraciones (s) estimadas en línea
+    recta con haversine, multiplicadas por un factor de desvío vial.
+    """
+    speed_kmh = speed_kmh or FALLBACK_SPEED_KMH
+    detour_factor = detour_factor or FALLBACK_DETOUR_FACTOR
+
+    points = np.radians(np.asarray(coords, dtype=np.float64))
+    lon, lat = points[:, 0], points[:, 1]
+    dlon = lon[:, None] - lon[None, :]
+    dlat = lat[:, None] - lat[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    meters = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1))) * detour_factor
+
+    distances = meters.astype(np.int64)
+    durations = (meters / (speed_kmh / 3.6)).astype(np.int64)
+    return distances, durations
+
+
+def fill_unroutable(coords, distances, durations):
+    """
+    Reemplaza las celdas sin ruta (null de OSRM, NaN) por la estimación
+    haversine; devuelve las matrices como ndarray.
+    """
+    distances = np.array(distances, dtype=np.float64)
+    durations = np.array(durations, dtype=np.float64)
+    np.fill_diagonal(distances, 0)
+    np.fill_diagonal(durations, 0)
+    unroutable = ~np.isfinite(distances) | ~np.isfinite(durations)
+    if unroutable.any():
+        logger.warning("%d pares sin ruta vial: se estiman con haversine", int(unroutable.sum()))
+        est_dist, est_dur = haversine_matrices(coords)
+        distances[unroutable] = est_dist[unroutable]
+        durations[unroutable] = est_dur[unroutable]
+    return distances, durations
+
+
+def nearest_neighbours(coords, k, block_rows=256):
+    """Índices (n x k) de los k puntos más cercanos en línea recta a cada punto"""
+    points = np.asarray(coords, dtype=np.float64)
+    x = points[:, 0] * math.cos(math.radians(points[:, 1].mean()))
+    y = points[:, 1]
+    k = min(k, len(points) - 1)
+
+    neighbours = np.empty((len(points), k), dtype=np.int64)
+    for start in range(0, len(points), block_rows):
+        stop = min(start + block_rows, len(points))
+        dist = (x[start:stop, None] - x[None, :]) ** 2 + (y[start:stop, None] - y[None, :]) ** 2
+        dist[np.arange(stop - start), np.arange(start, stop)] = np.inf
+        neighbours[start:stop] = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    return neighbours
+
+
+def neighbour_blocks(coords, neighbours, group_size=None):
+    """
+    Agrupa los puntos en franjas geográficas de group_size filas; cada bloque
+    pide a OSRM sus filas hacia la unión de sus vecinos (y el depósito).
+    """
+    group_size = group_size or OSRM_TABLE_BLOCK_SIZE
+    points = np.asarray(coords, dtype=np.float64)
+    strips = max(1, round(math.sqrt(len(points) / group_size)))
+    by_x = np.argsort(points[:, 0], kind="stable")
+    order = np.concatenate([
+        strip[np.argsort(points[strip, 1], kind="stable")]
+        for strip in np.array_split(by_x, strips)
+    ])
+
+    blocks = []
+    for start in range(0, len(order), group_size):
+        rows = sorted(int(i) for i in order[start:start + group_size])
+        cols = sorted(set(neighbours[rows].ravel().tolist()) | {0})
+        blocks.append((rows, cols))
+    return blocks
+
+
+def sparse_matrices(coords, neighbours, fetch=None):
+    """
+    Matrices para instancias enormes sin la tabla n x n de OSRM: se piden
+    solo las distancias viales de cada punto a sus k vecinos más cercanos,
+    de cada punto al depósito y del depósito a todos (cada ruta empieza y
+    termina en él); el resto se estima con haversine calibrado con esas
+    mismas celdas (factor de desvío y velocidad medios).
+    Devuelve (distancias, duraciones, información) con matrices NumPy.
+    """
+    fetch = fetch or osrm_block
+    start = time.perf_counter()
+    size = len(coords)
+    nearest = nearest_neighbours(coords, neighbours)
+    blocks = neighbour_blocks(coords, nearest)
+    # Los bloques de vecinos ya incluyen la columna del depósito; falta su fila
+    blocks.append(([0], list(range(size))))
+
+    # Celdas viales pedidas: (filas, columnas, distancias, duraciones)
+    fetched = []
+    with ThreadPoolExecutor(max_workers=OSRM_TABLE_MAX_WORKERS) as pool:
+        futures = {pool.submit(in_context(fetch), coords, rows, cols): (rows, cols)
+                   for rows, cols in blocks}
+        for future in as_completed(futures):
+            rows, cols = futures[future]
+            block_dist, block_dur = future.result()
+            fetched.append((rows, cols,
+                            np.array(block_dist, dtype=np.float64),
+                            np.array(block_dur, dtype=np.float64)))
+
+    # Calibración del haversine con los pares vecinos (sin desvío, a 1 m/s)
+    straight, _ = haversine_matrices(coords, speed_kmh=3.6, detour_factor=1)
+    ratios, total_dist, total_dur = [], 0.0, 0.0
+    for rows, cols, block_dist, block_dur in fetched:
+        grid = np.ix_(rows, cols)
+        line = straight[grid]
+        valid = ~np.isnan(block_dist) & ~np.isnan(block_dur) & (line > 50)
+        ratios.append(block_dist[valid] / line[valid])
+        total_dist += block_dist[valid].sum()
+        total_dur += block_dur[valid].sum()
+    ratios = np.concatenate(ratios)
+    detour_factor = float(np.median(ratios)) if len(ratios) else FALLBACK_DETOUR_FACTOR
+    speed_kmh = float(total_dist / total_dur * 3.6) if total_dur else FALLBACK_SPEED_KMH
+
+    distances = straight * detour_factor
+    durations = distances / (speed_kmh / 3.6)
+    del straight
+
+    # Celdas distintas pedidas (los bloques se solapan en vecinos y depósito)
+    requested = np.zeros((size, size), dtype=bool)
+    for rows, cols, block_dist, block_dur in fetched:
+        grid = np.ix_(rows, cols)
+        known = ~np.isnan(block_dist) & ~np.isnan(block_dur)
+        distances[grid] = np.where(known, block_dist, distances[grid])
+        durations[grid] = np.where(known, block_dur, durations[grid])
+        requested[grid] = True
+    np.fill_diagonal(requested, False)
+    cells = int(requested.sum())
+    del requested
+    np.fill_diagonal(distances, 0)
+    np.fill_diagonal(durations, 0)
+
+    info = {
+        "points": size,
+        "neighbours": nearest.shape[1],
+        "osrm_cells": cells,
+        "osrm_fraction": cells / (size * size),
+        "detour_factor": round(detour_factor, 3),
+        "speed_kmh": round(speed_kmh, 1),
+        "time": round(time.perf_counter() - start, 3)
+    }
+    return distances, durations, info
+
+class MatrixSession:
+    """
+    Matrices de una sesión de planificación. Al agregar un punto solo se
+    consultan a OSRM su fila y su columna; al quitarlo se descartan sin red.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.coords = []
+        self.distances = np.zeros((0, 0))
+        self.durations = np.zeros((0, 0))
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+
+    def sync(self, coords):
+        """Ajusta la sesión a coords y devuelve sus matrices en ese orden"""
+        keys = [matrix_cache.key(c) for c in coords]
+        with self.lock:
+            self.last_used = time.time()
+
+            # Quitar filas y columnas de puntos que ya no están
+            wanted = set(keys)
+            keep = [i for i, key in enumerate(self.keys) if key in wanted]
+            if len(keep) < len(self.keys):
+                self._take(keep)
+
+            # Agregar puntos nuevos consultando solo sus filas y columnas
+            new_keys, new_coords = [], []
+            known = set(self.keys)
+            for key, coord in zip(keys, coords):
+                if key not in known:
+                    known.add(key)
+                    new_keys.append(key)
+                    new_coords.append(coord)
+            if new_keys:
+                self._extend(new_keys, new_coords)
+
+            position = {key: i for i, key in enumerate(self.keys)}
+            order = [position[key] for key in keys]
+            grid = np.ix_(order, order)
+            distances, durations = fill_unroutable(coords, self.distances[grid], self.durations[grid])
+            return distances.tolist(), durations.tolist()
+
+    def _take(self, keep):
+        self.keys = [self.keys[i] for i in keep]
+        self.coords = [self.coords[i] for i in keep]
+        self.distances = self.distances[np.ix_(keep, keep)]
+        self.durations = self.durations[np.ix_(keep, keep)]
+
+    def _extend(self, new_keys, new_coords):
+        old, added = len(self.keys), len(new_keys)
+        size = old + added
+        coords = self.coords + new_coords
+        new_rows = list(range(old, size))
+        logger.info("Sesión de matrices: %d puntos conocidos, %d nuevos", old, added)
+
+        distances = np.zeros((size, size))
+        durations = np.zeros((size, size))
+        distances[:old, :old] = self.distances
+        durations[:old, :old] = self.durations
+
+        # Filas de los puntos nuevos hacia todos (added x size)
+        block_dist, block_dur = osrm_block(coords, new_rows, list(range(size)))
+        distances[old:, :] = np.array(block_dist, dtype=np.float64)
+        durations[old:, :] = np.array(block_dur, dtype=np.float64)
+
+        # Columnas de los puntos conocidos hacia los nuevos (old x added)
+        if old:
+            block_dist, block_dur = osrm_block(coords, list(range(old)), new_rows)
+            distances[:old, old:] = np.array(block_dist, dtype=np.float64)
+            durations[:old, old:] = np.array(block_dur, dtype=np.float64)
+
+        np.fill_diagonal(distances, 0)
+        np.fill_diagonal(durations, 0)
+        self.keys = self.keys + new_keys
+        self.coords = coords
+        self.distances, self.durations = distances, durations
+
+
+matrix_sessions = OrderedDict()
+matrix_sessions_lock = threading.Lock()
+
+
+def get_matrix_session(session_id):
+    """Devuelve (o crea) la sesión de matrices, descartando las vencidas o sobrantes"""
+    now = time.time()
+    with matrix_sessions_lock:
+        for expired in [sid for sid, session in matrix_sessions.items()
+                        if now - session.last_used > MATRIX_SESSION_TTL]:
+            del matrix_sessions[expired]
+        session = matrix_sessions.get(session_id)
+        if session is None:
+            session = matrix_sessions[session_id] = MatrixSession()
+        matrix_sessions.move_to_end(session_id)
+        while len(matrix_sessions) > MATRIX_SESSION_MAX:
+            matrix_sessions.popitem(last=False)
+    return session
+
+
+def get_session_matrices(session_id, coords):
+    """Matrices de distancias y tiempos usando la sesión de planificación indicada (como get_matrices)"""
+    try:
+        distances, durations = get_matrix_session(session_id).sync(coords)
+        return distances, durations, False
+    except Exception as e:
+        logger.warning("Error en sesión de matrices %s: %s", session_id, e)
+        # La sesión puede haber quedado a medio actualizar: se descarta
+        with matrix_sessions_lock:
+            matrix_sessions.pop(session_id, None)
+        return get_matrices(coords)
+
+
+@app.route("/sessions/<session_id>", methods=["GET"])
+def get_session(session_id):
+    session = matrix_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Sesión no encontrada"}), 404
+    return jsonify({
+        "session_id": session_id,
+        "num_points": len(session.keys),
+        "last_used": session.last_used
+    })
+
+
+@app.route("/sessions/<session_id>", methods=["DELETE"])
+def delete_session(session_id):
+    with matrix_sessions_lock:
+        session = matrix_sessions.pop(session_id, None)
+    if session is None:
+        return jsonify({"error": "Sesión no encontrada"}), 404
+    return jsonify({"session_id": session_id, "deleted": True})
+
+
+def get_route_geometry(puntos, max_waypoints=None):
+    """
+    Consulta OSRM para obtener la geometría de la ruta completa.
+    Pide todos los puntos en una sola llamada route, partiéndola en tramos
+    de hasta max_waypoints puntos si es más larga (max_waypoints=2 equivale
+    a consultar tramo por tramo).
+    Corrige automáticamente el orden lat/lon.
+    """
+    max_waypoints = max(2, max_waypoints or OSRM_ROUTE_MAX_WAYPOINTS)
+    geometry = []
+
+    # Tramos consecutivos que comparten el punto de unión
+    for i, start in enumerate(range(0, len(puntos) - 1, max_waypoints - 1)):
+        try:
+            # Asegurar orden correcto: (lon, lat)
+            chunk = puntos[start:start + max_waypoints]
+            timings = solve_timings_var.get()
+            if timings is not None:
+                timings.count_call("route")
+            segment = routing_backend.route(chunk)
+
+            if segment:
+                # Evitar duplicar el punto inicial del siguiente tramo
+                if i > 0 and len(segment) > 1:
+                    segment = segment[1:]
+                geometry.extend(segment)
+            else:
+                logger.warning("El motor de rutas no devolvió rutas para el tramo %d", i)
+        except OsrmUnavailable as e:
+            logger.warning("Geometría omitida: %s", e)
+            break
+        except Exception as e:
+            logger.warning("Error tramo %d: %s", i, e)
+            continue
+
+    return geometry
+     
+
+def get_route_geometries(routes_coords, deadline=None):
+    """
+    Obtiene la geometría de varias rutas en paralelo, en el orden recibido.
+    Las rutas que no terminen antes del plazo total quedan sin geometría.
+    """
+    deadline = GEOMETRY_DEADLINE if deadline is None else deadline
+    geometries = [[] for _ in routes_coords]
+    pending = [i for i, coords in enumerate(routes_coords) if len(coords) > 1]
+    if not pending:
+        return geometries
+
+    pool = ThreadPoolExecutor(max_workers=min(GEOMETRY_MAX_WORKERS, len(pending)))
+    futures = {pool.submit(in_context(get_route_geometry), routes_coords[i]): i for i in pending}
+    try:
+        done, not_done = wait(futures, timeout=deadline)
+        for future in done:
+            try:
+                geometries[futures[future]] = future.result()
+            except Exception as e:
+                logger.warning("Error geometría ruta %d: %s", futures[future], e)
+        if not_done:
+            logger.warning("Plazo de geometría (%ss) agotado: %d rutas sin geometría",
+                           deadline, len(not_done))
+    finally:
+        # No esperar a las consultas que sigan en curso
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return geometries
+
+
+def build_problem_data(coords, weights, time_windows, dist_matrix, dur_matrix,
+                       num_vehicles, vehicle_capacity):
+    """
+    Construye la instancia PyVRP (flota, depósito, clientes y matrices).
+    El primer punto es el depósito. Las matrices se pasan directamente a
+    ProblemData en lugar de agregar cada arista al modelo.
+    """
+    depot = Depot(x=coords[0][0], y=coords[0][1], tw_early=0, tw_late=1440)
+
+    clients = []
+    for idx, (lon, lat) in enumerate(coords[1:]):
+        tw_early, tw_late = time_windows[idx + 1]
+        clients.append(Client(
+            x=lon,
+            y=lat,
+            delivery=[weights[idx + 1]],
+            tw_early=tw_early,
+            tw_late=tw_late,
+            service_duration=15  # 15 minutos de servicio
+        ))
+
+    vehicle_type = VehicleType(num_available=num_vehicles, capacity=[vehicle_capacity])
+
+    # PyVRP espera distancias en metros y duraciones en segundos
+    return ProblemData(
+        clients, [depot], [vehicle_type],
+        distance_matrices=[to_int_matrix(dist_matrix)],
+        duration_matrices=[to_int_matrix(dur_matrix)]
+    )
+
+
+def to_int_matrix(matrix):
+    """Convierte una matriz (listas o ndarray) a enteros de NumPy con diagonal cero"""
+    values = np.asarray(matrix, dtype=np.float64)
+    np.fill_diagonal(values, 0)
+    if not np.isfinite(values).all():
+        raise ValueError("La matriz tiene celdas sin ruta (None/NaN)")
+    return values.astype(np.int64)  # trunca como int()
+
+
+def with_fleet(problem, num_vehicles):
+    """Devuelve la misma instancia con otro número de vehículos disponibles"""
+    vehicle_types = [vt.replace(num_available=num_vehicles) for vt in problem.vehicle_types()]
+    return problem.replace(vehicle_types=vehicle_types)
+
+
+def resolve_stop_spec(stop, num_clients):
+    """
+    Parámetros de parada de la búsqueda. Por defecto el tiempo máximo crece
+    con el número de clientes y la búsqueda termina antes si no mejora en
+    STOP_NO_IMPROVEMENT iteraciones. La petición puede fijar max_runtime
+    (segundos), no_improvement y max_iterations; null desactiva uno de ellos.
+    """
+    spec = {
+        "max_runtime": min(STOP_MAX_RUNTIME, max(STOP_MIN_RUNTIME, STOP_RUNTIME_PER_CLIENT * num_clients)),
+        "no_improvement": STOP_NO_IMPROVEMENT,
+        "max_iterations": None
+    }
+    if stop is not None and not isinstance(stop, dict):
+        raise ValueError("stop debe ser un objeto")
+    for name, value in (stop or {}).items():
+        if name not in spec:
+            raise ValueError(f"Criterio de parada desconocido: {name}")
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)
+                                  or value <= 0):
+            raise ValueError(f"{name} debe ser un número positivo")
+        spec[name] = value
+
+    if spec["max_runtime"] is None and spec["max_iterations"] is None:
+        raise ValueError("Se necesita max_runtime o max_iterations para acotar la búsqueda")
+    if spec["max_runtime"] is not None:
+        spec["max_runtime"] = min(spec["max_runtime"], STOP_RUNTIME_LIMIT)
+    return spec
+
+
+def make_stopping_criterion(stop_spec, job=None):
+    """Criterio de parada de cada intento (nuevo en cada uno: MaxRuntime mide desde su primer uso)"""
+    criteria = []
+    if stop_spec["max_runtime"] is not None:
+        criteria.append(MaxRuntime(stop_spec["max_runtime"]))
+    if stop_spec["no_improvement"] is not None:
+        criteria.append(NoImprovement(int(stop_spec["no_improvement"])))
+    if stop_spec["max_iterations"] is not None:
+        criteria.append(MaxIterations(int(stop_spec["max_iterations"])))
+
+    stop = MultipleCriteria(criteria)
+    if job is not None:
+        stop = JobStop(stop, job)
+    return stop
+
+
+class EventStop:
+    """
+    Criterio de parada para búsquedas en otros procesos: corta cuando se
+    activa un evento compartido, consultándolo como mucho cada interval
+    segundos. Con la misma frecuencia publica (iteraciones, mejor costo)
+    en progress[key].
+    """
+
+    def __init__(self, criterion, event, interval=0.2, progress=None, key=None):
+        self.criterion = criterion
+        self.event = event
+        self.interval = interval
+        self.progress = progress
+        self.key = key
+        self.iterations = 0
+        self._next_check = 0.0
+        self._stopped = False
+
+    def __call__(self, best_cost):
+        self.iterations += 1
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.interval
+            self._stopped = self.event.is_set()
+            if self.progress is not None:
+                self.progress[self.key] = (self.iterations, best_cost)
+        return self._stopped or self.criterion(best_cost)
+
+
+_process_pool = None
+_process_manager = None
+_process_pool_lock = threading.Lock()
+
+
+def process_pool():
+    """Pool de procesos compartido para búsquedas en paralelo (se crea al primer uso)"""
+    global _process_pool, _process_manager
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_manager = multiprocessing.Manager()
+            # Un proceso por núcleo: la carrera de flota reparte MAX_PARALLEL_SEEDS
+            # entre sus dos búsquedas (ver run_fleet_race)
+            _process_pool = ProcessPoolExecutor(max_workers=max(2, MAX_PARALLEL_SEEDS))
+    return _process_pool
+
+
+def solve_seed(problem, stop_spec, seed, stop_event=None, progress=None):
+    """Una búsqueda HGS completa; se ejecuta en un proceso del pool"""
+    stop = make_stopping_criterion(stop_spec)
+    if stop_event is not None:
+        stop = EventStop(stop, stop_event, progress=progress, key=seed)
+    return solve_problem(problem, stop=stop, display=False, seed=seed)
+
+
+Search = namedtuple("Search", ["futures", "seeds", "stop_event", "progress"])
+
+
+def submit_search(problem, stop_spec, parallel_seeds):
+    """
+    Lanza una búsqueda por semilla en el pool de procesos, con su propio
+    evento de parada y un diccionario compartido para el progreso.
+    """
+    pool = process_pool()
+    stop_event = _process_manager.Event()
+    progress = _process_manager.dict()
+    seeds = [42 + k for k in range(parallel_seeds)]
+    futures = [pool.submit(solve_seed, problem, stop_spec, seed, stop_event, progress)
+               for seed in seeds]
+    return Search(futures, seeds, stop_event, progress)
+
+
+def wait_search(search, job=None):
+    """Espera a que termine una búsqueda, propagando la cancelación o parada del trabajo"""
+    if job is not None:
+        job.attempt += 1
+    while wait(search.futures, timeout=0.5).not_done:
+        if job is not None:
+            job.record_search_progress([search])
+            if job.should_stop():
+                search.stop_event.set()
+
+
+def collect_search(search):
+    """Mejor resultado de una búsqueda terminada y estadísticas por semilla"""
+    results = [future.result() for future in search.futures]
+    best_idx = min(range(len(results)),
+                   key=lambda k: (not results[k].is_feasible(), results[k].cost()))
+    feasible_costs = [float(r.cost()) for r in results if r.is_feasible()]
+
+    seed_statistics = {
+        "best_seed": search.seeds[best_idx],
+        "num_feasible": len(feasible_costs),
+        "min_cost": min(feasible_costs) if feasible_costs else None,
+        "mean_cost": sum(feasible_costs) / len(feasible_costs) if feasible_costs else None,
+        "max_cost": max(feasible_costs) if feasible_costs else None,
+        "seeds": [{
+            "seed": seed,
+            "cost": float(r.cost()) if r.is_feasible() else None,
+            "is_feasible": r.is_feasible(),
+            "iterations": r.num_iterations,
+            "runtime": r.runtime
+        } for seed, r in zip(search.seeds, results)]
+    }
+    return results[best_idx], seed_statistics
+
+
+def run_search(problem, stop_spec, job=None, parallel_seeds=1):
+    """
+    Ejecuta la búsqueda HGS. Con parallel_seeds > 1 lanza una búsqueda por
+    semilla en el pool de procesos, todas con el mismo presupuesto de tiempo,
+    y devuelve la mejor junto con las estadísticas por semilla.
+    """
+    if parallel_seeds <= 1:
+        return solve_problem(problem, stop=make_stopping_criterion(stop_spec, job), display=False, seed=42), None
+
+    logger.info("Búsqueda en paralelo con %d semillas", parallel_seeds)
+    search = submit_search(problem, stop_spec, parallel_seeds)
+    wait_search(search, job)
+    return collect_search(search)
+
+
+def run_fleet_race(problem, num_vehicles, stop_spec, job=None, parallel_seeds=1):
+    """
+    Resuelve a la vez con num_vehicles y con num_vehicles + 1 en procesos
+    separados. Si la flota menor es factible se detiene la otra búsqueda.
+    Cada búsqueda usa como mucho MAX_PARALLEL_SEEDS // 2 semillas para no
+    correr más procesos que núcleos: con más, cada HGS tendría menos CPU en
+    el mismo MaxRuntime y la carrera empeoraría la solución.
+    Devuelve (resultado, estadísticas por semilla, vehículos usados).
+    """
+    parallel_seeds = max(1, min(parallel_seeds, MAX_PARALLEL_SEEDS // 2))
+    logger.info("Resolviendo en paralelo con %d y %d vehículos", num_vehicles, num_vehicles + 1)
+    base = submit_search(problem, stop_spec, parallel_seeds)
+    extra = submit_search(with_fleet(problem, num_vehicles + 1), stop_spec, parallel_seeds)
+
+    if job is not None:
+        job.attempt += 1
+    while wait(base.futures, timeout=0.5).not_done:
+        if job is not None:
+            job.record_search_progress([base, extra])
+            if job.should_stop():
+                base.stop_event.set()
+                extra.stop_event.set()
+
+    res, seed_statistics = collect_search(base)
+    if res.is_feasible():
+        extra.stop_event.set()
+        for future in extra.futures:
+            future.cancel()
+        return res, seed_statistics, num_vehicles
+
+    logger.info("Sin solución factible con %d, usando %d vehículos", num_vehicles, num_vehicles + 1)
+    FLEET_RETRIES.inc(mode="race")
+    wait_search(extra, job)
+    res, seed_statistics = collect_search(extra)
+    return res, seed_statistics, num_vehicles + 1
+
+
+def resolve_decomposition(options):
+    """Opciones del modo de descomposición (true usa los valores por defecto)"""
+    spec = {
+        "method": "sweep",
+        "cluster_size": DECOMPOSITION_CLUSTER_SIZE,
+        "boundary_routes": DECOMPOSITION_BOUNDARY_ROUTES
+    }
+    if options is True:
+        return spec
+    if not isinstance(options, dict):
+        raise ValueError("decomposition debe ser true o un objeto")
+    for name, value in options.items():
+        if name not in spec:
+            raise ValueError(f"Opción de descomposición desconocida: {name}")
+        spec[name] = value
+    if spec["method"] not in ("sweep", "kmeans"):
+        raise ValueError("method debe ser 'sweep' o 'kmeans'")
+    if not isinstance(spec["cluster_size"], int) or spec["cluster_size"] < 2:
+        raise ValueError("cluster_size debe ser un entero mayor o igual a 2")
+    if not isinstance(spec["boundary_routes"], int) or spec["boundary_routes"] < 0:
+        raise ValueError("boundary_routes debe ser un entero no negativo")
+    return spec
+
+
+def kmeans_labels(points, k, iterations=25, seed=0):
+    """k-medias (Lloyd) sobre puntos n x 2; devuelve la etiqueta de cada punto"""
+    rng = np.random.default_rng(seed)
+    centers = points[rng.choice(len(points), size=k, replace=False)]
+    labels = np.zeros(len(points), dtype=np.int64)
+    for iteration in range(iterations):
+        dist = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new_labels = dist.argmin(axis=1)
+        if np.array_equal(new_labels, labels) and iteration > 0:
+            break
+        labels = new_labels
+        for c in range(k):
+            members = points[labels == c]
+            if len(members):
+                centers[c] = members.mean(axis=0)
+    return labels
+
+
+def partition_clients(coords, weights, vehicle_capacity, cluster_size, method="sweep"):
+    """
+    Agrupa los clientes (índices 1..n) en clusters de hasta cluster_size
+    clientes y de demanda acotada a los vehículos completos previstos por
+    cluster. Los cortes buscan demandas cercanas a vehículos enteros para
+    que la flota repartida entre clusters alcance. sweep: orden angular
+    alrededor del depósito empezando tras el mayor hueco, cortando al llegar
+    a cualquiera de los dos topes. kmeans: k-medias sobre las coordenadas
+    proyectadas; los clusters que superan un tope se vuelven a cortar con
+    sweep dentro de ellos.
+    """
+    points = np.asarray(coords, dtype=np.float64)
+    depot, clients = points[0], points[1:]
+    # Proyección equirectangular local alrededor del depósito
+    xy = np.column_stack([
+        (clients[:, 0] - depot[0]) * math.cos(math.radians(depot[1])),
+        clients[:, 1] - depot[1]
+    ])
+
+    angles = np.arctan2(xy[:, 1], xy[:, 0])
+    # Carga objetivo por vehículo: la ocupación media de la flota óptima, para
+    # que cada cluster tenga la misma holgura y el reparto de flota cierre
+    total_demand = sum(weights[1:])
+    mean_weight = total_demand / len(clients)
+    unit = vehicle_capacity
+    if total_demand > 0:
+        unit = total_demand / math.ceil(total_demand / vehicle_capacity)
+    max_demand = max(1, math.ceil(cluster_size * mean_weight / vehicle_capacity)) * unit
+
+    def sweep(members, size_cap=cluster_size):
+        """Corta members (posiciones en clients) en orden angular según los topes"""
+        order = members[np.argsort(angles[members])]
+        gaps = np.diff(np.append(angles[order], angles[order[0]] + 2 * math.pi))
+        order = np.roll(order, -(int(gaps.argmax()) + 1))
+        clusters, current, load = [], [], 0
+        for idx in order + 1:
+            weight = weights[idx]
+            if current and (len(current) >= size_cap or load + weight > max_demand):
+                # Cortado por tamaño: se retrocede hasta completar vehículos
+                # enteros, para que la flota repartida no pierda capacidad
+                # (cortado por demanda ya cabe en max_demand, que es múltiplo de unit)
+                carry = []
+                full = load // unit * unit if load + weight <= max_demand else load
+                while full and load > full and len(current) > size_cap // 2:
+                    carry.append(current.pop())
+                    load -= weights[carry[-1]]
+                if load > full:
+                    current += reversed(carry)
+                    carry = []
+                clusters.append(current)
+                current = carry[::-1]
+                load = sum(weights[i] for i in current)
+            current.append(int(idx))
+            load += weight
+        if current:
+            clusters.append(current)
+        return clusters
+
+    if method == "kmeans":
+        k = math.ceil(len(clients) / cluster_size)
+        labels = kmeans_labels(xy, k)
+        groups = [np.flatnonzero(labels == c) for c in range(k)]
+        groups = [g for g in groups if len(g)]
+        centers = [xy[g].mean(axis=0) for g in groups]
+        order = sorted(range(len(groups)), key=lambda c: math.atan2(centers[c][1], centers[c][0]))
+
+        # Cada grupo (en orden angular) pasa al siguiente los clientes más
+        # cercanos a él hasta que su demanda cabe en vehículos enteros
+        clusters = []
+        carry = np.array([], dtype=np.int64)
+        for pos, c in enumerate(order):
+            members = np.concatenate([groups[c], carry])
+            carry = np.array([], dtype=np.int64)
+            demand = sum(weights[i + 1] for i in members)
+            full = demand // unit * unit
+            if pos + 1 < len(order) and full and demand > full:
+                target = centers[order[pos + 1]]
+                members = members[np.argsort(((xy[members] - target) ** 2).sum(axis=1))]
+                moved = 0
+                while demand > full and moved < len(members) - 1:
+                    demand -= weights[members[moved] + 1]
+                    moved += 1
+                carry, members = members[:moved], members[moved:]
+
+            if len(members) > cluster_size or demand > max_demand:
+                # Partes de tamaño parejo para no dejar un resto diminuto
+                parts = max(math.ceil(len(members) / cluster_size), math.ceil(demand / max_demand))
+                clusters += sweep(members, math.ceil(len(members) / parts))
+            else:
+                clusters.append([int(i) + 1 for i in members])
+        return clusters
+
+    return sweep(np.arange(len(clients)))
+
+
+def solve_subproblem(problem, stop_spec, initial_routes=None, key=0, stop_event=None, progress=None):
+    """
+    Resuelve un subproblema en un proceso del pool (opcionalmente partiendo
+    de initial_routes) y devuelve sus rutas en índices locales.
+    """
+    stop = make_stopping_criterion(stop_spec)
+    if stop_event is not None:
+        stop = EventStop(stop, stop_event, progress=progress, key=key)
+    if initial_routes:
+        res = solve_from(problem, stop, Solution(problem, initial_routes), display=False)
+    else:
+        res = solve_problem(problem, stop=stop, display=False)
+    return {
+        "routes": [route.visits() for route in res.best.routes()],
+        "cost": float(res.cost()) if res.is_feasible() else None,
+        "is_feasible": res.is_feasible(),
+        "iterations": res.num_iterations,
+        "runtime": res.runtime
+    }
+
+
+class DecomposedSolution:
+    """Rutas combinadas de la descomposición (índices globales de ubicación)"""
 
-def get_matrices(coords):
-    """Consulta OSRM para obtener matriz de distancias y tiempos"""
-    try:
-        coords_str = ";".join([f"{lon},{lat}" for lon, lat in coords])
-        url = f"{OSRM_URL}{coords_str}?annotations=distance,duration"
-        print(f"Consultando OSRM: {url}")
-        
-        res = requests.get(url, timeout=30)
-        res.raise_for_status()
-        data = res.json()
-        
-        print(f"Matriz de distancias: {data['distances']}")
-        print(f"Matriz de duraciones: {data['durations']}")
-        
-        return data["distances"], data["durations"]
-    except Exception as e:
-        print(f"Error en OSRM: {e}")
-        # Crear matriz de distancia euclidiana como fallback.
-        size = len(coords)
-        distances = [[0] * size for _ in range(size)]
-        durations = [[0] * size for _ in range(size)]
-        
-        for i in range(size):
-            for j in range(size):
-                if i != j:
-                    # Distancia euclidiana aproximada (1 grado ≈ 111 km)
-                    lat1, lon1 = coords[i][1], coords[i][0]
-                    lat2, lon2 = coords[j][1], coords[j][0]
-                    dist = math.sqrt((lat2 - lat1)**2 + (lon2 - lon1)**2) * 111000  # metros
-                    distances[i][j] = int(dist)
-                    durations[i][j] = int(dist / 13.9)  # tiempo en segundos (50 km/h)
-        
-        return distances, durations
+    def __init__(self, routes):
+        self._routes = routes
+
+    def routes(self):
+        return self._routes
+
+
+class DecomposedResult:
+    """Resultado de la descomposición con la interfaz de pyvrp.Result que usa build_solution_response"""
 
-def get_route_geometry(puntos):
+    def __init__(self, routes, cost, feasible, iterations, runtime):
+        self.best = DecomposedSolution(routes)
+        self.num_iterations = iterations
+        self.runtime = runtime
+        self._cost = cost
+        self._feasible = feasible
+
+    def cost(self):
+        return self._cost if self._feasible else math.inf
+
+    def is_feasible(self):
+        return self._feasible
+
+
+def split_fleet(demands, num_vehicles):
     """
-    Consulta OSRM para obtener la geometría tramo por tramo.
-    Corrige automáticamente el orden lat/lon.
+    Reparte num_vehicles entre clusters en proporción a su demanda: cada
+    vehículo va al cluster con más carga por vehículo, así primero todos
+    reciben uno y luego los que superan la capacidad antes que el resto.
     """
-    geometry = []
+    fleets = [0] * len(demands)
+    heap = [(-math.inf, k) for k in range(len(demands))]
+    for _ in range(num_vehicles):
+        if not heap:
+            break
+        _, k = heapq.heappop(heap)
+        fleets[k] += 1
+        heapq.heappush(heap, (-demands[k] / fleets[k], k))
+    return fleets
 
-    for i in range(len(puntos) - 1):
-        try:
-            # Asegurar orden correcto: (lon, lat)
-            lon1, lat1 = puntos[i][0], puntos[i][1]
-            lon2, lat2 = puntos[i + 1][0], puntos[i + 1][1]
 
-            coord_pair = f"{lon1},{lat1};{lon2},{lat2}"
-            url = f"http://router.project-osrm.org/route/v1/driving/{coord_pair}?overview=full&geometries=geojson"
+def solve_decomposed(coords, weights, time_windows, dist_matrix, dur_matrix,
+                     vehicle_capacity, stop, options, num_vehicles, allow_extra=False, job=None):
+    """
+    Descompone la instancia en clusters, resuelve cada uno en paralelo en el
+    pool de procesos y luego re-optimiza juntas las rutas de cada frontera
+    entre clusters vecinos. La flota num_vehicles se reparte entre clusters;
+    con allow_extra, si algún cluster queda infactible se le da un único
+    vehículo más (como el reintento con +1 del camino completo).
+    Devuelve (resultado, información de la descomposición).
+    """
+    start = time.perf_counter()
+    clusters = partition_clients(coords, weights, vehicle_capacity,
+                                 options["cluster_size"], options["method"])
+    decomposition_time = time.perf_counter() - start
+    logger.info("Descomposición %s: %d clusters (%.3fs)",
+                options["method"], len(clusters), decomposition_time)
 
-            res = requests.get(url, timeout=15).json()
+    distances = to_int_matrix(dist_matrix)
+    durations = to_int_matrix(dur_matrix)
 
-            if res.get("routes") and len(res["routes"]) > 0:
-                segment = res["routes"][0]["geometry"]["coordinates"]
-                # Evitar duplicar el punto inicial del siguiente tramo
-                if i > 0 and len(segment) > 1:
-                    segment = segment[1:]
-                geometry.extend(segment)
-            else:
-                print(f"⚠️ OSRM devolvió sin rutas para tramo {i}")
-        except Exception as e:
-            print(f"Error tramo {i}: {e}")
-            continue
+    def subproblem(clients, num_vehicles):
+        idx = [0] + clients
+        grid = np.ix_(idx, idx)
+        return build_problem_data(
+            [coords[i] for i in idx], [weights[i] for i in idx], [time_windows[i] for i in idx],
+            distances[grid], durations[grid], num_vehicles, vehicle_capacity
+        )
 
-    return geometry
-     
+    def route_cost(route):
+        path = [0] + route + [0]
+        return int(distances[path[:-1], path[1:]].sum())
 
-@app.route("/solve", methods=["POST"])
-def solve():
+    def run_batch(tasks):
+        """Ejecuta [(problema, parada, rutas iniciales)] en el pool y espera los resultados"""
+        pool = process_pool()
+        stop_event = _process_manager.Event()
+        progress = _process_manager.dict()
+        futures = [pool.submit(solve_subproblem, problem, spec, initial, k, stop_event, progress)
+                   for k, (problem, spec, initial) in enumerate(tasks)]
+        wait_search(Search(futures, list(range(len(tasks))), stop_event, progress), job)
+        return [future.result() for future in futures]
+
+    def solve_clusters(ks):
+        """Resuelve los clusters ks con su flota; sin vehículos no hay solución"""
+        solvable = [k for k in ks if fleets[k] > 0]
+        solved = dict(zip(solvable, run_batch([
+            (subproblem(clusters[k], fleets[k]), resolve_stop_spec(stop, len(clusters[k])), None)
+            for k in solvable
+        ]))) if solvable else {}
+        for k in ks:
+            results[k] = solved.get(k) or {
+                "routes": [], "cost": None, "is_feasible": False, "iterations": 0, "runtime": 0.0
+            }
+
+    # 1) Resolver cada cluster con su parte de la flota
+    demands = [sum(weights[i] for i in cluster) for cluster in clusters]
+    fleets = split_fleet(demands, num_vehicles)
+    results = [None] * len(clusters)
+    solve_clusters(range(len(clusters)))
+
+    # Infactible: un solo vehículo extra para el cluster más cargado por vehículo
+    extra_vehicle = False
+    infeasible = [k for k, result in enumerate(results) if not result["is_feasible"]]
+    if infeasible and allow_extra and not (job is not None and job.stop_requested()):
+        k = max(infeasible, key=lambda c: demands[c] / max(fleets[c], 1))
+        logger.info("Descomposición infactible: cluster %d con %d vehículos", k, fleets[k] + 1)
+        FLEET_RETRIES.inc(mode="retry")
+        fleets[k] += 1
+        extra_vehicle = True
+        solve_clusters([k])
+
+    routes, route_cluster = [], []
+    for k, (cluster, result) in enumerate(zip(clusters, results)):
+        for route in result["routes"]:
+            routes.append([cluster[v - 1] for v in route])
+            route_cluster.append(k)
+    iterations = sum(result["iterations"] for result in results)
+
+    # 2) Mejora de fronteras: rutas de clusters vecinos más cercanas entre sí
+    boundary_start = time.perf_counter()
+    boundary_improvement = 0
+    num_boundaries = 0
+    stopped = job is not None and job.should_stop()
+    if len(clusters) > 1 and options["boundary_routes"] > 0 and not stopped:
+        points = np.asarray(coords, dtype=np.float64)
+        cluster_centers = [points[cluster].mean(axis=0) for cluster in clusters]
+        route_centers = [points[route].mean(axis=0) for route in routes]
+
+        if options["method"] == "sweep":
+            pairs = [(k, (k + 1) % len(clusters)) for k in range(len(clusters))]
+            pairs = pairs[:1] if len(clusters) == 2 else pairs
+        else:
+            pairs = sorted({tuple(sorted((k, min(
+                (c for c in range(len(clusters)) if c != k),
+                key=lambda c: np.linalg.norm(cluster_centers[k] - cluster_centers[c])
+            )))) for k in range(len(clusters))})
+
+        used, tasks, groups = set(), [], []
+        for a, b in pairs:
+            group = []
+            for own, other in ((a, b), (b, a)):
+                candidates = sorted(
+                    (r for r in range(len(routes)) if route_cluster[r] == own and r not in used),
+                    key=lambda r: np.linalg.norm(route_centers[r] - cluster_centers[other])
+                )
+                group += candidates[:options["boundary_routes"]]
+            if len({route_cluster[r] for r in group}) < 2:
+                continue
+            used.update(group)
+            clients = [c for r in group for c in routes[r]]
+            local = {c: i + 1 for i, c in enumerate(clients)}
+            initial = [[local[c] for c in routes[r]] for r in group]
+            spec = resolve_stop_spec(stop, len(clients))
+            if stop is None:
+                spec["max_runtime"] *= REOPT_RUNTIME_FACTOR
+                spec["no_improvement"] = REOPT_NO_IMPROVEMENT
+            tasks.append((subproblem(clients, len(group)), spec, initial))
+            groups.append((group, clients))
+
+        num_boundaries = len(tasks)
+        for (group, clients), result in zip(groups, run_batch(tasks) if tasks else []):
+            if not result["is_feasible"]:
+                continue
+            new_routes = [[clients[v - 1] for v in route] for route in result["routes"]]
+            old_cost = sum(route_cost(routes[r]) for r in group)
+            new_cost = sum(route_cost(route) for route in new_routes)
+            if new_cost < old_cost:
+                boundary_improvement += old_cost - new_cost
+                for r in group:
+                    routes[r] = []
+                routes.extend(new_routes)
+                route_cluster.extend([route_cluster[group[0]]] * len(new_routes))
+            iterations += result["iterations"]
+
+    routes = [route for route in routes if route]
+    feasible = all(result["is_feasible"] for result in results)
+    if len(routes) > sum(fleets):
+        logger.warning("La descomposición usa %d rutas con una flota de %d", len(routes), sum(fleets))
+        feasible = False
+    cost = sum(route_cost(route) for route in routes)
+    runtime = time.perf_counter() - start
+
+    info = {
+        "method": options["method"],
+        "num_clusters": len(clusters),
+        "decomposition_time": decomposition_time,
+        "clusters": [{
+            "num_clients": len(cluster),
+            "vehicles": fleet,
+            "solve_time": result["runtime"],
+            "cost": result["cost"],
+            "is_feasible": result["is_feasible"]
+        } for cluster, fleet, result in zip(clusters, fleets, results)],
+        "boundary_pass": {
+            "num_boundaries": num_boundaries,
+            "time": time.perf_counter() - boundary_start,
+            "improvement": boundary_improvement
+        },
+        "requested_vehicles": num_vehicles,
+        "extra_vehicle": extra_vehicle,
+        "num_vehicles": sum(fleets),
+        "final_cost": cost,
+        "total_time": runtime
+    }
+    return DecomposedResult(routes, cost, feasible, iterations, runtime), info
+
+
+def build_solution_response(res, coords, weights, dist_matrix, dur_matrix,
+                            num_vehicles, vehicle_capacity, stop_spec):
+    """Arma la respuesta de /solve (rutas, geometría y estadísticas) para un resultado de PyVRP"""
+    # PROCESAR RUTAS COMPLETAS (CON DEPÓSITO AL INICIO Y FINAL)
+    routes = []
+    total_distance = 0
+    total_duration = 0
+    used_vehicles = 0
+
+    logger.debug("Número total de rutas en solución: %d", len(res.best.routes()))
+
+    for vehicle_id, route in enumerate(res.best.routes()):
+
+        # CORREGIR: AGREGAR DEPÓSITO AL INICIO Y FINAL SI NO ESTÁ PRESENTE
+        route_indices = list(route)
+
+        # Si la ruta no empieza con el depósito (índice 0), agregarlo
+        if route_indices[0] != 0:
+            route_indices.insert(0, 0)
+
+        # Si la ruta no termina con el depósito (índice 0), agregarlo
+        if route_indices[-1] != 0:
+            route_indices.append(0)
+
+        # Crear lista de coordenadas COMPLETA (incluyendo depósito)
+        route_coords = [coords[idx] for idx in route_indices]
+
+        # Puntos de entrega (excluyendo depósitos)
+        delivery_points = []
+        route_weights = []
+        route_times = []
+
+        # Calcular tiempos de llegada REALES
+        current_time = 0  # tiempo desde salida del depósito (minutos)
+
+        for idx, node_idx in enumerate(route_indices):
+            if node_idx != 0:  # No es el depósito
+                delivery_points.append(coords[node_idx])
+                route_weights.append(weights[node_idx])
+
+                # Tiempo de llegada
+                arrival_minutes = current_time
+                route_times.append(arrival_minutes)
+
+                # Tiempo de servicio
+                current_time += 15
+
+            # Agregar tiempo de viaje al siguiente punto (si existe)
+            if idx < len(route_indices) - 1:
+                next_node_idx = route_indices[idx + 1]
+                travel_time_seconds = dur_matrix[node_idx][next_node_idx]
+                travel_time_minutes = travel_time_seconds / 60.0
+                current_time += travel_time_minutes
+
+        # CALCULAR DISTANCIA Y DURACIÓN DE LA RUTA COMPLETA
+        route_dist = 0
+        route_dur = 0
+        for i in range(len(route_indices)-1):
+            route_dist += dist_matrix[route_indices[i]][route_indices[i+1]]
+            route_dur += dur_matrix[route_indices[i]][route_indices[i+1]]
+
+        # INCLUIR RUTA EN LA RESPUESTA (la geometría se obtiene después, en paralelo)
+        route_data = {
+            "vehicle_id": vehicle_id + 1,
+            "nodes": delivery_points,
+            "weights": route_weights,
+            "arrival_times": route_times,
+            "full_route": route_coords,
+            "geometry": [],
+            "distance": route_dist,
+            "duration": route_dur,
+            "total_weight": sum(route_weights),
+            "num_clients": len(delivery_points),
+            "route_indices": route_indices  # Para depuración
+        }
+
+        routes.append(route_data)
+
+        if len(delivery_points) > 0:
+            used_vehicles += 1
+            total_distance += route_dist
+            total_duration += route_dur
+
+            logger.debug("Ruta %d: %d clientes, distancia: %sm, duración: %ss, secuencia: %s",
+                         vehicle_id + 1, len(delivery_points), route_dist, route_dur, route_indices)
+        else:
+            logger.debug("Ruta %d: Sin clientes asignados", vehicle_id + 1)
+
+    # OBTENER GEOMETRÍA DE TODAS LAS RUTAS EN PARALELO
+    with stage("geometry"):
+        geometries = get_route_geometries([route["full_route"] for route in routes])
+    for route, geometry in zip(routes, geometries):
+        route["geometry"] = geometry
+        logger.debug("Vehículo %d: %d clientes, %d puntos de geometría",
+                     route["vehicle_id"], route["num_clients"], len(geometry))
+
+    logger.info("Rutas procesadas: %d, vehículos usados: %d", len(routes), used_vehicles)
+
+    response = {
+        "num_routes": len(routes),
+        "routes": routes,
+        "depot": coords[0],
+        "vehicle_info": {
+            "available": num_vehicles,
+            "used": used_vehicles,
+            "capacity": vehicle_capacity
+        },
+        "statistics": {
+            "total_distance": total_distance,
+            "total_duration": total_duration,
+            "total_weight": sum(weights[1:]),
+            "num_clients": len(coords) - 1
+        },
+        "solution_quality": {
+            "cost": float(res.cost()),
+            "iterations": res.num_iterations,
+            "runtime": res.runtime,
+            "stop": stop_spec,
+            "is_feasible": res.is_feasible()
+        }
+    }
+
+    return response
+
+
+class SolutionCache:
+    """
+    Caché LRU con vencimiento (TTL) de respuestas de /solve, indexada por la
+    huella canónica de la instancia. Guarda la respuesta serializada en JSON.
+    """
+
+    def __init__(self, max_entries=SOLUTION_CACHE_MAX_ENTRIES, ttl=SOLUTION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return json.loads(entry[1])
+
+    def put(self, key, response):
+        payload = json.dumps(response).encode()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time(), payload)
+            self._bytes += len(payload)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0
+            }
+
+
+solution_cache = SolutionCache()
+
+
+@app.route("/cache/solutions", methods=["GET"])
+def solution_cache_stats():
+    return jsonify(solution_cache.stats())
+
+
+def solution_fingerprint(coords, weights, time_windows, fleet, settings):
+    """Huella SHA-256 canónica de pedidos, flota y parámetros del solver"""
+    canonical = {
+        "profile": routing_backend.profile,
+        "orders": [
+            [round(lon, MATRIX_CACHE_PRECISION), round(lat, MATRIX_CACHE_PRECISION), weight, list(tw)]
+            for (lon, lat), weight, tw in zip(coords, weights, time_windows)
+        ],
+        "fleet": fleet,
+        "settings": settings
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+@SOLVES_IN_PROGRESS.track()
+def solve_vrp(data, job=None):
+    """
+    Resuelve el VRP para el cuerpo de una petición /solve.
+    Devuelve (respuesta, código HTTP). Si se indica un trabajo, la búsqueda
+    se interrumpe cuando este se cancela. Con "timings": true la respuesta
+    incluye el desglose de tiempos por etapa.
+    """
+    timings = SolveTimings() if isinstance(data, dict) and data.get("timings") else None
+    token = solve_timings_var.set(timings)
+    try:
+        result, status = _solve_vrp(data, job)
+    finally:
+        solve_timings_var.reset(token)
+    if timings is not None and status == 200:
+        result["timings"] = timings.to_dict()
+    return result, status
+
+
+def _solve_vrp(data, job=None):
     try:
-        data = request.get_json()
-        
         # Datos de vehículos
         num_vehicles = data.get("num_vehicles", 3)
         vehicle_capacity = data.get("vehicle_capacity", 1000)
@@ -97,244 +2175,669 @@ def solve():
         coords = [order["coordinates"] for order in orders]
         weights = [order.get("weight", 1) for order in orders]
         time_windows = [order.get("time_window", [0, 1440]) for order in orders]
+
+        # Búsquedas independientes con distintas semillas (1 = búsqueda única)
+        parallel_seeds = data.get("parallel_seeds", 1)
+        if not isinstance(parallel_seeds, int) or isinstance(parallel_seeds, bool) or parallel_seeds < 1:
+            return {"error": "parallel_seeds debe ser un entero mayor o igual a 1"}, 400
+        parallel_seeds = min(parallel_seeds, MAX_PARALLEL_SEEDS)
+
+        # Resolver la flota óptima y la óptima + 1 a la vez en lugar de en secuencia
+        race_fleets = data.get("race_fleets", RACE_FLEETS)
+        if not isinstance(race_fleets, bool):
+            return {"error": "race_fleets debe ser true o false"}, 400
+
+        # Criterio de parada según el tamaño de la instancia o lo pedido
+        try:
+            stop_spec = resolve_stop_spec(data.get("stop"), max(len(orders) - 1, 0))
+        except ValueError as e:
+            return {"error": "Criterio de parada inválido", "details": str(e)}, 400
+
+        # Descomposición en clusters para instancias grandes
+        decomposition = data.get("decomposition")
+        if decomposition:
+            try:
+                decomposition = resolve_decomposition(decomposition)
+            except ValueError as e:
+                return {"error": "Opciones de descomposición inválidas", "details": str(e)}, 400
+        else:
+            decomposition = None
+
+        # Vecinos por punto de la matriz dispersa (null = automático, 0 = matriz completa)
+        sparse_neighbours = data.get("sparse_neighbours")
+        if sparse_neighbours is not None and (not isinstance(sparse_neighbours, int)
+                                              or isinstance(sparse_neighbours, bool)
+                                              or sparse_neighbours < 0):
+            return {"error": "sparse_neighbours debe ser un entero no negativo"}, 400
         
         # ✅ NUEVA VALIDACIÓN: Calcular número óptimo de vehículos
         total_demand = sum(weights[1:])
         optimal_vehicles = math.ceil(total_demand / vehicle_capacity)
         
-        print(f"🔍 Análisis de optimización:")
-        print(f"   - Demanda total: {total_demand} kg")
-        print(f"   - Capacidad por vehículo: {vehicle_capacity} kg") 
-        print(f"   - Vehículos solicitados: {num_vehicles}")
-        print(f"   - Vehículos óptimos teóricos: {optimal_vehicles}")
+        logger.info("Análisis de optimización", extra={
+            "clients": len(orders) - 1,
+            "total_demand": total_demand,
+            "vehicle_capacity": vehicle_capacity,
+            "requested_vehicles": num_vehicles,
+            "optimal_vehicles": optimal_vehicles
+        })
         
         # ✅ FORZAR OPTIMIZACIÓN: Usar el mínimo necesario
         if num_vehicles > optimal_vehicles:
-            print(f"   🔄 OPTIMIZANDO: Usando {optimal_vehicles} vehículos en lugar de {num_vehicles}")
+            logger.info("Usando %d vehículos en lugar de %d", optimal_vehicles, num_vehicles)
             num_vehicles = optimal_vehicles
         
         # Validaciones
         if len(coords) < 2:
-            return jsonify({"error": "Se necesitan al menos 2 puntos (depósito + clientes)"}), 400
-        
-        # Obtener matrices de OSRM
-        dist_matrix, dur_matrix = get_matrices(coords)
-        
-        # Crear modelo VRP
-        m = Model()
-        
-        # ✅ AGREGAR SOLO EL NÚMERO ÓPTIMO DE VEHÍCULOS
-        vehicle_type = m.add_vehicle_type(
-            num_available=num_vehicles,  # Ahora será 2 en lugar de 3
-            capacity=vehicle_capacity
-        )
+            return {"error": "Se necesitan al menos 2 puntos (depósito + clientes)"}, 400
 
-        # El primer punto es el depósito
-        depot = m.add_depot(
-            x=coords[0][0], 
-            y=coords[0][1],
-            tw_early=0,
-            tw_late=1440
+        # Respuesta guardada para la misma instancia (desactivable con use_cache=false)
+        use_cache = bool(data.get("use_cache", True))
+        cache_key = solution_fingerprint(
+            coords, weights, time_windows,
+            {"num_vehicles": data.get("num_vehicles", 3), "vehicle_capacity": vehicle_capacity},
+            {"parallel_seeds": parallel_seeds, "race_fleets": race_fleets, "stop": stop_spec,
+             "decomposition": decomposition, "sparse_neighbours": sparse_neighbours}
         )
-
-        # Agregar clientes
-        clients = []
-        for idx, (lon, lat) in enumerate(coords[1:]):
-            weight = weights[idx + 1]
-            tw_early, tw_late = time_windows[idx + 1]
-            
-            client = m.add_client(
-                x=lon, 
-                y=lat,
-                delivery=weight,
-                tw_early=tw_early,
-                tw_late=tw_late,
-                service_duration=15  # 15 minutos de servicio
-            )
-            clients.append(client)
-
-        # Agregar aristas al modelo
-        for i, frm in enumerate(m.locations):
-            for j, to in enumerate(m.locations):
-                if i != j:
-                    # PyVRP espera distancias en metros y duraciones en segundos
-                    distance = int(dist_matrix[i][j])
-                    duration = int(dur_matrix[i][j])
-                    m.add_edge(frm, to, distance=distance, duration=duration)
-
-        # Resolver con timeout más corto
-        stopping_criterion = MaxRuntime(30)
+        if use_cache:
+            cached = solution_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Solución en caché (%s)", cache_key[:12])
+                SOLVE_OUTCOMES.inc(outcome="cached")
+                timings = solve_timings_var.get()
+                if timings is not None:
+                    timings.solution_cache_hit = True
+                cached["cached"] = True
+                return cached, 200
+        
+        # Obtener matrices de OSRM (con session_id solo se consultan los puntos nuevos)
+        session_id = data.get("session_id")
+        with stage("matrix"):
+            if session_id:
+                dist_matrix, dur_matrix, matrix_fallback = get_session_matrices(str(session_id), coords)
+            else:
+                dist_matrix, dur_matrix, matrix_fallback = get_matrices(coords, sparse_neighbours)
         
-        res = m.solve(stop=stopping_criterion, display=True, seed=42)
+        seed_statistics = None
+        decomposition_info = None
+        if decomposition is not None and len(coords) - 1 > decomposition["cluster_size"]:
+            # Resolver por clusters en paralelo, sin construir la instancia completa
+            with stage("search"):
+                res, decomposition_info = solve_decomposed(
+                    coords, weights, time_windows, dist_matrix, dur_matrix,
+                    vehicle_capacity, data.get("stop"), decomposition, num_vehicles,
+                    allow_extra=num_vehicles == optimal_vehicles, job=job
+                )
+            num_vehicles = decomposition_info["num_vehicles"]
+        else:
+            # Crear instancia VRP una sola vez (depósito, clientes y aristas)
+            with stage("build"):
+                problem = build_problem_data(
+                    coords, weights, time_windows, dist_matrix, dur_matrix,
+                    num_vehicles, vehicle_capacity
+                )
+
+            with stage("search"):
+                if race_fleets and num_vehicles == optimal_vehicles:
+                    res, seed_statistics, num_vehicles = run_fleet_race(
+                        problem, num_vehicles, stop_spec, job, parallel_seeds
+                    )
+                else:
+                    res, seed_statistics = run_search(problem, stop_spec, job, parallel_seeds)
+        if job is not None and job.cancelled():
+            SOLVE_OUTCOMES.inc(outcome="cancelled")
+            return {"error": "Trabajo cancelado"}, 409
 
         if not res.is_feasible():
             # Si no es factible con vehículos óptimos, intentar con 1 más
-            if num_vehicles == optimal_vehicles:
-                print(f"   🔄 Intentando con {optimal_vehicles + 1} vehículos...")
+            # (salvo que se haya pedido aceptar la mejor solución actual)
+            stopped = job is not None and job.stop_requested()
+            if num_vehicles == optimal_vehicles and not stopped and decomposition_info is None:
+                logger.info("Intentando con %d vehículos", optimal_vehicles + 1)
+                FLEET_RETRIES.inc(mode="retry")
                 num_vehicles = optimal_vehicles + 1
-                
-                # Recrear modelo con un vehículo adicional
-                m = Model()
-                vehicle_type = m.add_vehicle_type(
-                    num_available=num_vehicles,
-                    capacity=vehicle_capacity
-                )
-                depot = m.add_depot(x=coords[0][0], y=coords[0][1], tw_early=0, tw_late=1440)
-                
-                for idx, (lon, lat) in enumerate(coords[1:]):
-                    weight = weights[idx + 1]
-                    tw_early, tw_late = time_windows[idx + 1]
-                    client = m.add_client(
-                        x=lon, y=lat, delivery=weight,
-                        tw_early=tw_early, tw_late=tw_late, service_duration=15
+
+                # Reutilizar la instancia: solo cambia la flota
+                with stage("search"):
+                    res, seed_statistics = run_search(
+                        with_fleet(problem, num_vehicles), stop_spec, job, parallel_seeds
                     )
-                
-                for i, frm in enumerate(m.locations):
-                    for j, to in enumerate(m.locations):
-                        if i != j:
-                            distance = int(dist_matrix[i][j])
-                            duration = int(dur_matrix[i][j])
-                            m.add_edge(frm, to, distance=distance, duration=duration)
-                
-                res = m.solve(stop=stopping_criterion, display=True, seed=42)
+                if job is not None and job.cancelled():
+                    SOLVE_OUTCOMES.inc(outcome="cancelled")
+                    return {"error": "Trabajo cancelado"}, 409
             
             if not res.is_feasible():
-                return jsonify({
+                SOLVE_OUTCOMES.inc(outcome="infeasible")
+                return {
                     "error": "No se encontró una solución factible",
                     "details": "Intenta con menos clientes o mayor capacidad de vehículos"
-                }), 400
+                }, 400
 
-        # PROCESAR RUTAS COMPLETAS (CON DEPÓSITO AL INICIO Y FINAL)
-        routes = []
-        total_distance = 0
-        total_duration = 0
-        used_vehicles = 0
+        response = build_solution_response(
+            res, coords, weights, dist_matrix, dur_matrix,
+            num_vehicles, vehicle_capacity, stop_spec
+        )
+        if seed_statistics is not None:
+            response["seed_statistics"] = seed_statistics
+        if decomposition_info is not None:
+            response["decomposition"] = decomposition_info
 
-        print(f"Número total de rutas en solución: {len(res.best.routes())}")
+        # Ni una búsqueda detenida antes de tiempo ni una sobre matrices
+        # haversine de respaldo se guardan en la caché
+        # (se guarda con todos los campos; en un acierto solo cambia cached)
+        stopped_early = job is not None and job.stop_requested()
+        response["cached"] = False
+        response["stopped_early"] = stopped_early
+        if use_cache and not stopped_early and not matrix_fallback:
+            solution_cache.put(cache_key, response)
 
-        for vehicle_id, route in enumerate(res.best.routes()):
-            print(f"Ruta original {vehicle_id}: {list(route)}")
-            
-            # CORREGIR: AGREGAR DEPÓSITO AL INICIO Y FINAL SI NO ESTÁ PRESENTE
-            route_indices = list(route)
-            
-            # Si la ruta no empieza con el depósito (índice 0), agregarlo
-            if route_indices[0] != 0:
-                route_indices.insert(0, 0)
-                print(f"  → Agregado depósito al inicio: {route_indices}")
-            
-            # Si la ruta no termina con el depósito (índice 0), agregarlo
-            if route_indices[-1] != 0:
-                route_indices.append(0)
-                print(f"  → Agregado depósito al final: {route_indices}")
-            
-            # Crear lista de coordenadas COMPLETA (incluyendo depósito)
-            route_coords = [coords[idx] for idx in route_indices]
-            
-            # Puntos de entrega (excluyendo depósitos)
-            delivery_points = []
-            route_weights = []
-            route_times = []
-            
-            # Calcular tiempos de llegada REALES
-            current_time = 0  # tiempo desde salida del depósito (minutos)
-            
-            for idx, node_idx in enumerate(route_indices):
-                if node_idx != 0:  # No es el depósito
-                    delivery_points.append(coords[node_idx])
-                    route_weights.append(weights[node_idx])
-                    
-                    # Tiempo de llegada
-                    arrival_minutes = current_time
-                    route_times.append(arrival_minutes)
-                    
-                    # Tiempo de servicio
-                    current_time += 15
-                
-                # Agregar tiempo de viaje al siguiente punto (si existe)
-                if idx < len(route_indices) - 1:
-                    next_node_idx = route_indices[idx + 1]
-                    travel_time_seconds = dur_matrix[node_idx][next_node_idx]
-                    travel_time_minutes = travel_time_seconds / 60.0
-                    current_time += travel_time_minutes
-            
-            # CALCULAR DISTANCIA Y DURACIÓN DE LA RUTA COMPLETA
-            route_dist = 0
-            route_dur = 0
-            for i in range(len(route_indices)-1):
-                route_dist += dist_matrix[route_indices[i]][route_indices[i+1]]
-                route_dur += dur_matrix[route_indices[i]][route_indices[i+1]]
-            
-            # OBTENER GEOMETRÍA PARA LA RUTA COMPLETA
-            geometry = []
-            if len(route_coords) > 1:
-                geometry = get_route_geometry(route_coords)
-                print(f"Vehículo {vehicle_id+1}: {len(delivery_points)} clientes, {len(geometry)} puntos de geometría")
-            else:
-                print(f"Vehículo {vehicle_id+1}: Ruta vacía o con solo depósito")
-
-            # INCLUIR RUTA EN LA RESPUESTA
-            route_data = {
-                "vehicle_id": vehicle_id + 1,
-                "nodes": delivery_points,
-                "weights": route_weights,
-                "arrival_times": route_times,
-                "full_route": route_coords,
-                "geometry": geometry,
-                "distance": route_dist,
-                "duration": route_dur,
-                "total_weight": sum(route_weights),
-                "num_clients": len(delivery_points),
-                "route_indices": route_indices  # Para depuración
-            }
-            
-            routes.append(route_data)
-            
-            if len(delivery_points) > 0:
-                used_vehicles += 1
-                total_distance += route_dist
-                total_duration += route_dur
-
-                print(f"Ruta {vehicle_id+1}: {len(delivery_points)} clientes, "
-                      f"distancia: {route_dist}m, duración: {route_dur}s")
-                print(f"  Secuencia: {route_indices}")
-            else:
-                print(f"Ruta {vehicle_id+1}: Sin clientes asignados")
-
-        print(f"Total de rutas procesadas: {len(routes)}")
-        print(f"Vehículos usados: {used_vehicles}")
-
-        return jsonify({
-            "num_routes": len(routes),
-            "routes": routes,
-            "depot": coords[0],
-            "vehicle_info": {
-                "available": num_vehicles,
-                "used": used_vehicles,
-                "capacity": vehicle_capacity
-            },
-            "statistics": {
-                "total_distance": total_distance,
-                "total_duration": total_duration,
-                "total_weight": sum(weights[1:]),
-                "num_clients": len(clients)
-            },
-            "solution_quality": {
-                "cost": float(res.cost()),
-                "iterations": res.num_iterations,
-                "is_feasible": res.is_feasible()
-            }
-        })
+        SOLVE_OUTCOMES.inc(outcome="feasible")
+        return response, 200
 
     except Exception as e:
-        print(f"Error detallado en solve: {e}")
-        import traceback
-        print(f"Traceback completo: {traceback.format_exc()}")
-        
-        return jsonify({
+        logger.exception("Error en solve: %s", e)
+        SOLVE_OUTCOMES.inc(outcome="error")
+
+        return {
             "error": "Error al resolver el problema de ruteo",
             "details": str(e)
-        }), 500
+        }, 500
+
+
+# Perfilado opcional de /solve (cabecera X-Profile: 1 o ?profile=1), solo si está habilitado
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "vrp-profiles")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 50))
+
+profile_lock = threading.Lock()  # cProfile: un perfilado a la vez
+
+
+def profiling_requested():
+    return (request.headers.get("X-Profile") in ("1", "true")
+            or request.args.get("profile") in ("1", "true"))
+
+
+def profile_path(profile_id):
+    """Ruta del perfil guardado, o None si el id no es válido"""
+    if len(profile_id) != 16 or any(c not in "0123456789abcdef" for c in profile_id):
+        return None
+    return os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+
+
+def run_profiled(fn):
+    """
+    Ejecuta fn bajo cProfile y guarda el perfil (pstats) en PROFILE_DIR,
+    conservando los PROFILE_MAX_FILES más recientes. Solo se perfila el hilo
+    de la petición: la búsqueda con varias semillas corre en otros procesos.
+    Devuelve (resultado de fn, id del perfil).
+    """
+    profile_id = uuid.uuid4().hex[:16]
+    profiler = cProfile.Profile()
+    result = profiler.runcall(fn)
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(profile_path(profile_id))
+    files = sorted((entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".prof")),
+                   key=lambda entry: entry.stat().st_mtime)
+    for entry in files[:-PROFILE_MAX_FILES]:
+        os.remove(entry.path)
+    logger.info("Perfil guardado: %s", profile_id)
+    return result, profile_id
+
+
+@app.route("/solve", methods=["POST"])
+def solve():
+    if not profiling_requested():
+        return handle_solve()
+    if not PROFILING_ENABLED:
+        return jsonify({"error": "El perfilado no está habilitado",
+                        "details": "Configura PROFILING_ENABLED=1 en el servidor"}), 403
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({"error": "Ya hay un perfilado en curso"}), 429
+    try:
+        (response, status), profile_id = run_profiled(handle_solve)
+    finally:
+        profile_lock.release()
+    response.headers["X-Profile-ID"] = profile_id
+    response.headers["Access-Control-Expose-Headers"] = "X-Profile-ID"
+    return response, status
+
+
+def handle_solve():
+    data = request.get_json()
+    if isinstance(data, dict) and request.args.get("timings") in ("1", "true"):
+        data = dict(data, timings=True)
+    result, status = solve_vrp(data)
+
+    start = time.perf_counter()
+    with stage("serialization"):
+        response = jsonify(result)
+    if "timings" in result:
+        # Se serializa de nuevo para incluir lo que tardó la primera serialización
+        result["timings"]["serialization_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        response = jsonify(result)
+    return response, status
+
+
+@app.route("/profiles", methods=["GET"])
+def list_profiles():
+    if not PROFILING_ENABLED:
+        return jsonify({"error": "El perfilado no está habilitado"}), 403
+    if not os.path.isdir(PROFILE_DIR):
+        return jsonify({"profiles": []})
+    entries = sorted((entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".prof")),
+                     key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return jsonify({"profiles": [{
+        "id": entry.name[:-len(".prof")],
+        "created_at": entry.stat().st_mtime,
+        "size": entry.stat().st_size
+    } for entry in entries]})
+
+
+@app.route("/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """
+    Resumen JSON del perfil (funciones ordenadas por sort=cumulative|tottime,
+    hasta limit) o el archivo pstats original con format=pstats.
+    """
+    if not PROFILING_ENABLED:
+        return jsonify({"error": "El perfilado no está habilitado"}), 403
+    path = profile_path(profile_id)
+    if path is None or not os.path.exists(path):
+        return jsonify({"error": "Perfil no encontrado"}), 404
+
+    if request.args.get("format") == "pstats":
+        return send_from_directory(PROFILE_DIR, os.path.basename(path), as_attachment=True,
+                                   mimetype="application/octet-stream")
+
+    sort = request.args.get("sort", "cumulative")
+    if sort not in ("cumulative", "tottime"):
+        return jsonify({"error": "sort debe ser 'cumulative' o 'tottime'"}), 400
+    try:
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return jsonify({"error": "limit debe ser un entero"}), 400
+
+    stats = pstats.Stats(path)
+    column = 3 if sort == "cumulative" else 2
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][column], reverse=True)
+    return jsonify({
+        "id": profile_id,
+        "total_time": stats.total_tt,
+        "sort": sort,
+        "functions": [{
+            "function": name,
+            "file": filename,
+            "line": line,
+            "primitive_calls": primitive_calls,
+            "calls": calls,
+            "tottime": tottime,
+            "cumtime": cumtime
+        } for (filename, line, name), (primitive_calls, calls, tottime, cumtime, _) in rows[:limit]]
+    })
+
+
+def insert_clients(routes, clients, dist_matrix, weights, vehicle_capacity):
+    """
+    Inserta cada cliente nuevo en la posición de menor distancia adicional
+    de una ruta con capacidad libre; si ninguna tiene lugar abre una ruta nueva.
+    Las rutas son listas de índices de clientes, sin el depósito.
+    """
+    routes = [list(route) for route in routes]
+    loads = [sum(weights[idx] for idx in route) for route in routes]
+
+    for client in clients:
+        best = None  # (costo adicional, ruta, posición)
+        for r, route in enumerate(routes):
+            if loads[r] + weights[client] > vehicle_capacity:
+                continue
+            path = [0] + route + [0]
+            for pos in range(len(path) - 1):
+                frm, to = path[pos], path[pos + 1]
+                delta = dist_matrix[frm][client] + dist_matrix[client][to] - dist_matrix[frm][to]
+                if best is None or delta < best[0]:
+                    best = (delta, r, pos)
+
+        if best is None:
+            routes.append([client])
+            loads.append(weights[client])
+        else:
+            _, r, pos = best
+            routes[r].insert(pos, client)
+            loads[r] += weights[client]
+
+    return routes
+
+
+def solve_from(problem, stop, initial_solution, seed=42, display=False):
+    """
+    Igual que pyvrp.solve, pero la población inicial incluye initial_solution
+    (que también se reinserta en cada reinicio de la búsqueda).
+    """
+    params = SolveParams()
+    rng = RandomNumberGenerator(seed=seed)
+    ls = LocalSearch(problem, rng, compute_neighbours(problem, params.neighbourhood))
+    for node_op in params.node_ops:
+        ls.add_node_operator(node_op(problem))
+    for route_op in params.route_ops:
+        ls.add_route_operator(route_op(problem))
+
+    pm = PenaltyManager.init_from(problem, params.penalty)
+    pop = Population(broken_pairs_distance, params.population)
+    init = [initial_solution] + [
+        Solution.make_random(problem, rng)
+        for _ in range(params.population.min_pop_size - 1)
+    ]
+    crossover = selective_route_exchange if problem.num_vehicles > 1 else ordered_crossover
+
+    algo = GeneticAlgorithm(problem, pm, rng, pop, ls, crossover, init, params.genetic)
+    return algo.run(stop, collect_stats=True, display=display)
+
+
+def reoptimize_vrp(data):
+    """
+    Re-optimiza una solución previa tras agregar o quitar pedidos.
+    Recibe los pedidos y route_indices de la solución anterior, los pedidos
+    agregados (added) y los índices eliminados (removed). Repara las rutas
+    y las usa como punto de partida de una búsqueda corta.
+    Devuelve (respuesta, código HTTP) con el mismo formato que /solve.
+    """
+    try:
+        num_vehicles = data.get("num_vehicles", 3)
+        vehicle_capacity = data.get("vehicle_capacity", 1000)
+
+        previous_orders = data.get("orders", [])
+        previous_routes = data.get("route_indices", [])
+        added = data.get("added", [])
+        removed = set(data.get("removed", []))
+
+        if 0 in removed:
+            return {"error": "No se puede quitar el depósito (índice 0)"}, 400
+        invalid = [idx for route in previous_routes for idx in route
+                   if not 0 <= idx < len(previous_orders)]
+        invalid += [idx for idx in removed if not 0 <= idx < len(previous_orders)]
+        if invalid:
+            return {"error": "Índices fuera de rango", "details": str(sorted(set(invalid)))}, 400
+
+        # Nuevo listado de pedidos: los que quedan (mismo orden) y luego los agregados
+        kept = [idx for idx in range(len(previous_orders)) if idx not in removed]
+        new_index = {old: new for new, old in enumerate(kept)}
+        orders = [previous_orders[idx] for idx in kept] + added
+
+        coords = [order["coordinates"] for order in orders]
+        weights = [order.get("weight", 1) for order in orders]
+        time_windows = [order.get("time_window", [0, 1440]) for order in orders]
+
+        if len(coords) < 2:
+            return {"error": "Se necesitan al menos 2 puntos (depósito + clientes)"}, 400
+
+        # Búsqueda corta salvo que la petición indique otro criterio
+        try:
+            stop_spec = resolve_stop_spec(data.get("stop"), len(coords) - 1)
+        except ValueError as e:
+            return {"error": "Criterio de parada inválido", "details": str(e)}, 400
+        if data.get("stop") is None:
+            stop_spec["max_runtime"] *= REOPT_RUNTIME_FACTOR
+            stop_spec["no_improvement"] = REOPT_NO_IMPROVEMENT
+
+        # Con session_id solo se consultan a OSRM los puntos nuevos de la sesión
+        session_id = data.get("session_id")
+        if session_id:
+            dist_matrix, dur_matrix, _ = get_session_matrices(str(session_id), coords)
+        else:
+            dist_matrix, dur_matrix, _ = get_matrices(coords)
+
+        # Reparar la solución anterior
+        routes = [[new_index[idx] for idx in route if idx != 0 and idx in new_index]
+                  for route in previous_routes]
+        routes = [route for route in routes if route]
+        routes = insert_clients(routes, range(len(kept), len(orders)),
+                                dist_matrix, weights, vehicle_capacity)
+
+        optimal_vehicles = math.ceil(sum(weights[1:]) / vehicle_capacity)
+        num_vehicles = max(min(num_vehicles, optimal_vehicles), len(routes))
+        logger.info("Re-optimización: +%d / -%d pedidos, %d rutas reparadas, %d vehículos",
+                    len(added), len(removed), len(routes), num_vehicles)
+
+        problem = build_problem_data(
+            coords, weights, time_windows, dist_matrix, dur_matrix,
+            num_vehicles, vehicle_capacity
+        )
+        initial = Solution(problem, routes)
+        res = solve_from(problem, make_stopping_criterion(stop_spec), initial)
+
+        if not res.is_feasible():
+            return {
+                "error": "No se encontró una solución factible",
+                "details": "Intenta resolver de nuevo la instancia completa con /solve"
+            }, 400
+
+        response = build_solution_response(
+            res, coords, weights, dist_matrix, dur_matrix,
+            num_vehicles, vehicle_capacity, stop_spec
+        )
+        response["orders"] = orders
+        response["reoptimization"] = {
+            "added": len(added),
+            "removed": len(removed),
+            "initial_distance": initial.distance(),
+            "initial_is_feasible": initial.is_feasible()
+        }
+        return response, 200
+
+    except Exception as e:
+        logger.exception("Error en re-optimización: %s", e)
+
+        return {
+            "error": "Error al re-optimizar el problema de ruteo",
+            "details": str(e)
+        }, 500
+
+
+@app.route("/solve/reoptimize", methods=["POST"])
+def reoptimize():
+    result, status = reoptimize_vrp(request.get_json())
+    return jsonify(result), status
+
+
+# Trabajos asíncronos: la resolución corre en un pool fuera del hilo de la petición
+JOB_MAX_WORKERS = int(os.environ.get("JOB_MAX_WORKERS", 2))
+JOB_TTL = float(os.environ.get("JOB_TTL", 3600))  # segundos que se guarda un resultado
+JOB_EVENT_INTERVAL = float(os.environ.get("JOB_EVENT_INTERVAL", 0.5))  # segundos entre eventos SSE
+JOB_STOP_WAIT = float(os.environ.get("JOB_STOP_WAIT", 60))  # espera máxima de POST /jobs/<id>/stop
+
+job_executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="vrp-job")
+jobs = {}
+jobs_lock = threading.Lock()
+
+
+class Job:
+    """Estado de una resolución encolada con POST /jobs"""
+
+    def __init__(self, data):
+        self.id = uuid.uuid4().hex
+        self.data = data
+        self.status = "queued"
+        self.result = None
+        self.http_status = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._cancel_event = threading.Event()
+        self._stop_event = threading.Event()
+
+        # Progreso de la búsqueda en curso (lo actualiza el criterio de parada)
+        self.attempt = 0
+        self.iterations = 0
+        self.best_cost = INFEASIBLE_COST
+
+    def cancel(self):
+        self._cancel_event.set()
+        if self.future is not None and self.future.cancel():
+            self.status = "cancelled"
+            self.finished_at = time.time()
+
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def request_stop(self):
+        """Detiene la búsqueda y acepta la mejor solución encontrada hasta ahora"""
+        self._stop_event.set()
+
+    def stop_requested(self):
+        return self._stop_event.is_set()
+
+    def should_stop(self):
+        return self._cancel_event.is_set() or self._stop_event.is_set()
+
+    def run(self):
+        if self.cancelled():
+            return
+        request_id_var.set(self.id)
+        self.status = "running"
+        self.started_at = time.time()
+        result, http_status = solve_vrp(self.data, job=self)
+        self.finished_at = time.time()
+        if self.cancelled():
+            self.status = "cancelled"
+            return
+        self.result, self.http_status = result, http_status
+        self.status = "done" if http_status == 200 else "failed"
+
+    def record_search_progress(self, searches):
+        """Progreso de búsquedas en otros procesos: suma de iteraciones y mejor costo"""
+        snapshots = [snapshot for search in searches for snapshot in search.progress.values()]
+        if snapshots:
+            self.iterations = sum(iterations for iterations, _ in snapshots)
+            self.best_cost = min(best_cost for _, best_cost in snapshots)
+
+    def progress_info(self):
+        feasible = self.best_cost < INFEASIBLE_COST
+        end = self.finished_at or time.time()
+        return {
+            "status": self.status,
+            "attempt": self.attempt,
+            "iterations": self.iterations,
+            "best_cost": float(self.best_cost) if feasible else None,
+            "is_feasible": feasible,
+            "elapsed": end - self.started_at if self.started_at else 0.0
+        }
+
+    def to_dict(self):
+        info = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress_info()
+        }
+        if self.status in ("done", "failed"):
+            info["http_status"] = self.http_status
+            info["result"] = self.result
+        return info
+
+
+class JobStop:
+    """
+    Criterio de parada que además detiene la búsqueda si se cancela o se
+    detiene el trabajo y anota en él el progreso (una llamada por iteración).
+    """
+
+    def __init__(self, criterion, job):
+        self.criterion = criterion
+        self.job = job
+        job.attempt += 1
+        job.iterations = 0
+        job.best_cost = INFEASIBLE_COST
+
+    def __call__(self, best_cost):
+        job = self.job
+        job.iterations += 1
+        job.best_cost = best_cost
+        return job.should_stop() or self.criterion(best_cost)
+
+
+def purge_jobs():
+    """Elimina los trabajos terminados hace más de JOB_TTL segundos"""
+    now = time.time()
+    with jobs_lock:
+        expired = [job_id for job_id, job in jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > JOB_TTL]
+        for job_id in expired:
+            del jobs[job_id]
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    purge_jobs()
+    job = Job(request.get_json())
+    with jobs_lock:
+        jobs[job.id] = job
+    job.future = job_executor.submit(job.run)
+    return jsonify({"job_id": job.id, "status": job.status}), 202, {"Location": f"/jobs/{job.id}"}
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    Flujo Server-Sent Events con el progreso del trabajo cada JOB_EVENT_INTERVAL
+    segundos (eventos progress) y un evento final status con el resultado.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+
+    def stream():
+        while job.finished_at is None:
+            yield f"event: progress\ndata: {json.dumps(job.progress_info())}\n\n"
+            time.sleep(JOB_EVENT_INTERVAL)
+        yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/jobs/<job_id>/stop", methods=["POST"])
+def stop_job(job_id):
+    """
+    Detiene la búsqueda de un trabajo en curso y espera a que termine con la
+    mejor solución encontrada hasta el momento (con geometría).
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    if job.status == "queued":
+        return jsonify({"error": "El trabajo aún no comenzó", "job_id": job.id}), 409
+
+    if job.finished_at is None:
+        job.request_stop()
+        wait([job.future], timeout=JOB_STOP_WAIT)
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    if job.finished_at is None:
+        job.cancel()
+    else:
+        # Ya terminado: solo se descarta el resultado guardado
+        with jobs_lock:
+            jobs.pop(job_id, None)
+    return jsonify({"job_id": job.id, "status": job.status})
+
 
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
\ No newline at end of file
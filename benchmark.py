@@ -0,0 +1,566 @@
+"""
+Benchmarks de rendimiento del backend VRP.
+
+Uso:
+    python benchmark.py build --sizes 100 300 500
+    python benchmark.py edges --sizes 100 500 1000
+    python benchmark.py fallback --sizes 500 2000
+    python benchmark.py sparse --sizes 300 1000 --neighbours 10 30
+    python benchmark.py logging --sizes 100 500
+    python benchmark.py suite --sizes 50 100 --solomon C101.txt --output resultados.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from importlib import metadata
+
+import numpy as np
+from pyvrp import Model, Solution, solve
+from pyvrp.stop import MaxRuntime
+
+import app
+
+DEPOT = (-57.5759, -25.2637)
+
+
+def random_coords(num_clients, rng, spread=0.05):
+    """Depósito más num_clients puntos uniformes alrededor de DEPOT"""
+    return [list(DEPOT)] + [
+        [DEPOT[0] + rng.uniform(-spread, spread), DEPOT[1] + rng.uniform(-spread, spread)]
+        for _ in range(num_clients)
+    ]
+
+
+def random_instance(num_clients, seed=0, spread=0.05):
+    """Instancia sintética alrededor de DEPOT con matrices de distancia simples"""
+    rng = random.Random(seed)
+    coords = random_coords(num_clients, rng, spread)
+    weights = [0] + [rng.randint(1, 50) for _ in range(num_clients)]
+    time_windows = [[0, 1440] for _ in coords]
+
+    size = len(coords)
+    distances = [[0] * size for _ in range(size)]
+    durations = [[0] * size for _ in range(size)]
+    for i in range(size):
+        for j in range(size):
+            if i != j:
+                dist = math.dist(coords[i], coords[j]) * 111000
+                distances[i][j] = dist
+                durations[i][j] = dist / 13.9
+
+    return coords, weights, time_windows, distances, durations
+
+
+def timed(fn, repeat):
+    """Mejor tiempo (segundos) de repeat ejecuciones de fn"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_build(sizes, repeat):
+    """
+    Construcción de la instancia en el camino infactible -> +1 vehículo:
+    antes se construía el modelo con add_edge dos veces, ahora una vez con
+    matrices NumPy más un cambio de flota.
+    """
+    print(f"{'clientes':>8} | {'2x add_edge (s)':>15} | {'1x + flota (s)':>14} | {'mejora':>6}")
+    for n in sizes:
+        coords, weights, tws, dist, dur = random_instance(n)
+
+        def twice():
+            build_with_edges(coords, weights, tws, dist, dur, 2, 1000)
+            build_with_edges(coords, weights, tws, dist, dur, 3, 1000)
+
+        def once():
+            problem = app.build_problem_data(coords, weights, tws, dist, dur, 2, 1000)
+            app.with_fleet(problem, 3)
+
+        before = timed(twice, repeat)
+        after = timed(once, repeat)
+        print(f"{n:>8} | {before:>15.3f} | {after:>14.3f} | {before / after:>5.1f}x")
+
+
+def build_with_edges(coords, weights, time_windows, dist_matrix, dur_matrix,
+                     num_vehicles, vehicle_capacity):
+    """Construcción anterior: una llamada add_edge por cada par de ubicaciones"""
+    m = Model()
+    m.add_vehicle_type(num_available=num_vehicles, capacity=vehicle_capacity)
+    m.add_depot(x=coords[0][0], y=coords[0][1], tw_early=0, tw_late=1440)
+    for idx, (lon, lat) in enumerate(coords[1:]):
+        tw_early, tw_late = time_windows[idx + 1]
+        m.add_client(x=lon, y=lat, delivery=weights[idx + 1],
+                     tw_early=tw_early, tw_late=tw_late, service_duration=15)
+    for i, frm in enumerate(m.locations):
+        for j, to in enumerate(m.locations):
+            if i != j:
+                m.add_edge(frm, to, distance=int(dist_matrix[i][j]), duration=int(dur_matrix[i][j]))
+    return m.data()
+
+
+def bench_edges(sizes, repeat):
+    """Aristas una a una con Model.add_edge frente a matrices NumPy en ProblemData"""
+    print(f"{'ubicaciones':>11} | {'add_edge (s)':>12} | {'NumPy (s)':>9} | {'mejora':>6}")
+    for n in sizes:
+        instance = random_instance(n - 1)
+        before = timed(lambda: build_with_edges(*instance, 2, 1000), repeat)
+        after = timed(lambda: app.build_problem_data(*instance, 2, 1000), repeat)
+        print(f"{n:>11} | {before:>12.3f} | {after:>9.3f} | {before / after:>5.0f}x")
+
+
+def flat_degree_matrices(coords):
+    """Respaldo anterior: doble bucle con grados planos (1 grado = 111 km)"""
+    size = len(coords)
+    distances = [[0] * size for _ in range(size)]
+    durations = [[0] * size for _ in range(size)]
+    for i in range(size):
+        for j in range(size):
+            if i != j:
+                dist = math.sqrt((coords[j][1] - coords[i][1])**2 + (coords[j][0] - coords[i][0])**2) * 111000
+                distances[i][j] = int(dist)
+                durations[i][j] = int(dist / 13.9)
+    return distances, durations
+
+
+def bench_fallback(sizes, repeat):
+    """Matriz de respaldo: doble bucle Python frente a haversine vectorizado"""
+    print(f"{'puntos':>6} | {'bucle (s)':>9} | {'haversine (s)':>13} | {'mejora':>6}")
+    for n in sizes:
+        coords = random_coords(n - 1, random.Random(0))
+        before = timed(lambda: flat_degree_matrices(coords), repeat)
+        after = timed(lambda: app.haversine_matrices(coords), repeat)
+        print(f"{n:>6} | {before:>9.3f} | {after:>13.3f} | {before / after:>5.0f}x")
+
+
+def road_matrices(coords):
+    """
+    Red vial sintética (sin OSRM): distancia Manhattan en metros sobre una
+    cuadrícula girada por zona, con velocidad variable según la zona.
+    """
+    points = np.asarray(coords, dtype=np.float64)
+    x = (points[:, 0] - DEPOT[0]) * 111000 * math.cos(math.radians(DEPOT[1]))
+    y = (points[:, 1] - DEPOT[1]) * 111000
+    angle = np.where(x > 0, 0.0, math.pi / 6)
+    u = x * np.cos(angle) + y * np.sin(angle)
+    v = -x * np.sin(angle) + y * np.cos(angle)
+    distances = np.abs(u[:, None] - u[None, :]) + np.abs(v[:, None] - v[None, :])
+    speed = np.where(y > 0, 8.0, 14.0)  # m/s
+    durations = distances / ((speed[:, None] + speed[None, :]) / 2)
+    return distances, durations
+
+
+def bench_sparse(sizes, neighbours, runtime, seed):
+    """
+    Calidad de la matriz dispersa: se resuelve con la matriz completa y con la
+    dispersa (k vecinos viales + haversine calibrado) y ambas soluciones se
+    evalúan con las distancias viales reales.
+    """
+    print(f"{'clientes':>8} | {'k':>3} | {'celdas OSRM':>11} | {'matriz (s)':>10} | "
+          f"{'costo completa':>14} | {'costo dispersa':>14} | {'diferencia':>10}")
+    for n in sizes:
+        rng = random.Random(seed)
+        coords = random_coords(n, rng, spread=0.01)
+        weights = [0] + [rng.randint(1, 50) for _ in range(n)]
+        time_windows = [[0, 1440] for _ in coords]
+        capacity = 200
+        vehicles = math.ceil(sum(weights) / capacity) + 2
+        road_dist, road_dur = road_matrices(coords)
+
+        def fetch(coords, rows, cols):
+            grid = np.ix_(rows, cols)
+            return road_dist[grid].tolist(), road_dur[grid].tolist()
+
+        def road_cost(problem):
+            res = solve(problem, stop=MaxRuntime(runtime), seed=seed, display=False)
+            truth = app.build_problem_data(coords, weights, time_windows,
+                                           road_dist, road_dur, vehicles, capacity)
+            routes = [route.visits() for route in res.best.routes()]
+            return Solution(truth, routes).distance(), res.is_feasible()
+
+        full = app.build_problem_data(coords, weights, time_windows,
+                                      road_dist, road_dur, vehicles, capacity)
+        full_cost, _ = road_cost(full)
+
+        for k in neighbours:
+            start = time.perf_counter()
+            dist, dur, info = app.sparse_matrices(coords, k, fetch=fetch)
+            elapsed = time.perf_counter() - start
+            sparse = app.build_problem_data(coords, weights, time_windows,
+                                            dist, dur, vehicles, capacity)
+            sparse_cost, feasible = road_cost(sparse)
+            gap = (sparse_cost - full_cost) / full_cost * 100
+            print(f"{n:>8} | {k:>3} | {info['osrm_fraction']:>10.1%} | {elapsed:>10.3f} | "
+                  f"{full_cost:>14} | {sparse_cost:>14} | {gap:>+9.2f}%"
+                  + ("" if feasible else " (infactible)"))
+
+
+class StraightLineRouter:
+    """Motor de rutas en memoria: haversine con factor de desvío y geometría en línea recta"""
+
+    profile = "benchmark"
+
+    def table(self, coords, sources=None, destinations=None):
+        distances, durations = app.haversine_matrices(coords)
+        rows = range(len(coords)) if sources is None else sources
+        cols = range(len(coords)) if destinations is None else destinations
+        grid = np.ix_(list(rows), list(cols))
+        return distances[grid].tolist(), durations[grid].tolist()
+
+    def route(self, points):
+        return [list(p) for p in points]
+
+
+def solve_payload(num_clients, seed=0, spread=0.01, iterations=300):
+    """Cuerpo de /solve con una búsqueda de iteraciones fijas y sin caché de soluciones"""
+    coords, weights, time_windows, _, _ = random_instance(num_clients, seed, spread)
+    return {
+        "num_vehicles": num_clients,
+        "vehicle_capacity": 200,
+        "orders": [{"coordinates": c, "weight": w, "time_window": tw}
+                   for c, w, tw in zip(coords, weights, time_windows)],
+        "stop": {"max_iterations": iterations, "max_runtime": None, "no_improvement": None},
+        "use_cache": False
+    }
+
+
+def bench_logging(sizes, repeat, iterations):
+    """Latencia de /solve con el registro en INFO frente a DEBUG (volcado de matrices muestreado o siempre)"""
+    app.routing_backend = StraightLineRouter()
+    client = app.app.test_client()
+    modes = [("INFO", logging.INFO, app.LOG_MATRIX_SAMPLE_RATE),
+             (f"DEBUG {app.LOG_MATRIX_SAMPLE_RATE:.0%}", logging.DEBUG, app.LOG_MATRIX_SAMPLE_RATE),
+             ("DEBUG 100%", logging.DEBUG, 1.0)]
+
+    print(f"{'clientes':>8} | {'nivel':>10} | {'latencia (s)':>12} | {'registro (KB)':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            payload = solve_payload(n, iterations=iterations)
+            for name, level, sample_rate in modes:
+                path = os.path.join(tmp, f"{n}-{level}-{sample_rate}.log")
+                handler = logging.FileHandler(path)
+                handler.setFormatter(app.JsonFormatter())
+                handlers, app.logger.handlers = app.logger.handlers, [handler]
+                app.logger.setLevel(level)
+                app.LOG_MATRIX_SAMPLE_RATE = sample_rate
+                try:
+                    latency = timed(lambda: client.post("/solve", json=payload), repeat)
+                finally:
+                    handler.close()
+                    app.logger.handlers = handlers
+                size = os.path.getsize(path) / 1024 / repeat
+                print(f"{n:>8} | {name:>10} | {latency:>12.3f} | {size:>13.1f}")
+
+
+# Horizonte de la jornada en /solve: ventana fija del depósito en build_problem_data
+HORIZON = 1440
+
+
+def offset(depot, dx, dy):
+    """Punto a dx metros al este y dy metros al norte de depot"""
+    lat = depot[1] + dy / 111320
+    lon = depot[0] + dx / (111320 * math.cos(math.radians(depot[1])))
+    return [lon, lat]
+
+
+def synthetic_orders(kind, num_clients, rng, depot=DEPOT, radius=1500, time_windows="varied"):
+    """
+    Pedidos sintéticos alrededor de depot (radio en metros): uniform, clustered
+    (grupos gaussianos de ~25 clientes) o mixed (mitad y mitad). Los pesos
+    mezclan pedidos chicos y grandes; con time_windows="varied" la mitad de los
+    clientes tiene una ventana angosta dentro del horizonte.
+    """
+    def uniform():
+        return rng.uniform(-radius, radius), rng.uniform(-radius, radius)
+
+    centers = [(0.7 * x, 0.7 * y) for x, y in (uniform() for _ in range(max(2, num_clients // 25)))]
+
+    def clustered():
+        cx, cy = rng.choice(centers)
+        return cx + rng.gauss(0, radius * 0.08), cy + rng.gauss(0, radius * 0.08)
+
+    orders = [{"coordinates": list(depot), "weight": 0, "time_window": [0, HORIZON]}]
+    for i in range(num_clients):
+        dx, dy = uniform() if kind == "uniform" or (kind == "mixed" and i % 2) else clustered()
+        weight = rng.randint(1, 20) if rng.random() < 0.7 else rng.randint(20, 80)
+        window = [0, HORIZON]
+        if time_windows == "varied" and rng.random() < 0.5:
+            width = rng.randint(300, 900)
+            start = rng.randint(0, HORIZON - width)
+            window = [start, start + width]
+        orders.append({"coordinates": offset(depot, dx, dy), "weight": weight, "time_window": window})
+    return orders
+
+
+def load_solomon(path):
+    """Instancia VRPTW en formato Solomon/Homberger: flota, capacidad y clientes"""
+    with open(path) as fh:
+        lines = [line.split() for line in fh if line.strip()]
+
+    vehicles = capacity = None
+    customers = []
+    for i, parts in enumerate(lines):
+        if parts[0].upper() == "NUMBER":
+            vehicles, capacity = (int(v) for v in lines[i + 1][:2])
+        elif len(parts) == 7:
+            try:
+                customers.append(tuple(float(v) for v in parts))
+            except ValueError:
+                continue
+    return {"name": lines[0][0], "vehicles": vehicles, "capacity": capacity, "customers": customers}
+
+
+def solomon_orders(instance, depot=DEPOT):
+    """
+    Pedidos de /solve para una instancia Solomon: el horizonte del depósito
+    se lleva a HORIZON y las coordenadas a metros de modo que una unidad de
+    distancia tarde lo mismo que una unidad de tiempo con la matriz de respaldo.
+    El tiempo de servicio de la instancia se ignora (/solve usa uno fijo).
+    """
+    customers = instance["customers"]
+    _, x0, y0, _, _, due, _ = customers[0]
+    seconds_per_unit = HORIZON / due
+    meters_per_unit = seconds_per_unit * app.FALLBACK_SPEED_KMH / 3.6 / app.FALLBACK_DETOUR_FACTOR
+    return [{
+        "coordinates": offset(depot, (x - x0) * meters_per_unit, (y - y0) * meters_per_unit),
+        "weight": int(demand),
+        "time_window": [ready * seconds_per_unit, due * seconds_per_unit]
+    } for _, x, y, demand, ready, due, _ in customers]
+
+
+def street_grid(path, depot=DEPOT, radius=1500, spacing=100):
+    """Red vial GeoJSON en cuadrícula alrededor de depot: avenidas cada 5 calles a 50 km/h"""
+    steps = int(radius * 1.2 // spacing)
+    extent = steps * spacing
+    features = []
+    for i in range(-steps, steps + 1):
+        speed = 50 if i % 5 == 0 else 30
+        for line in ([offset(depot, i * spacing, -extent), offset(depot, i * spacing, extent)],
+                     [offset(depot, -extent, i * spacing), offset(depot, extent, i * spacing)]):
+            # Un vértice por cruce para que las calles queden conectadas
+            coords = [[line[0][0] + (line[1][0] - line[0][0]) * k / (2 * steps),
+                       line[0][1] + (line[1][1] - line[0][1]) * k / (2 * steps)]
+                      for k in range(2 * steps + 1)]
+            features.append({"type": "Feature", "properties": {"speed_kmh": speed},
+                             "geometry": {"type": "LineString", "coordinates": coords}})
+    with open(path, "w") as fh:
+        json.dump({"type": "FeatureCollection", "features": features}, fh)
+
+
+class UnavailableRouter:
+    """Motor de rutas caído: /solve usa la matriz de respaldo y omite la geometría"""
+
+    profile = "unavailable"
+
+    def table(self, coords, sources=None, destinations=None):
+        raise app.OsrmUnavailable("benchmark sin motor de rutas")
+
+    def route(self, points):
+        raise app.OsrmUnavailable("benchmark sin motor de rutas")
+
+
+def run_solve(client, orders, capacity, num_vehicles, runtime):
+    """Una petición /solve completa con timings; devuelve el registro del resultado"""
+    payload = {
+        "orders": orders,
+        "num_vehicles": num_vehicles,
+        "vehicle_capacity": capacity,
+        "stop": {"max_runtime": runtime},
+        "use_cache": False,
+        "timings": True
+    }
+    start = time.perf_counter()
+    res = client.post("/solve", json=payload)
+    wall_ms = (time.perf_counter() - start) * 1000
+    body = res.get_json()
+
+    feasible = res.status_code == 200 and body["solution_quality"]["is_feasible"]
+    return {
+        "status": res.status_code,
+        "feasible": feasible,
+        "cost": body["solution_quality"]["cost"] if feasible else None,
+        "distance": body["statistics"]["total_distance"] if feasible else None,
+        "vehicles_used": body["vehicle_info"]["used"] if feasible else None,
+        "wall_ms": round(wall_ms, 3),
+        "timings": body.get("timings")
+    }
+
+
+def summarize(runs):
+    """Promedios por motor de rutas y tipo de instancia"""
+    def mean(values):
+        values = [v for v in values if v is not None]
+        return round(sum(values) / len(values), 3) if values else None
+
+    groups = {}
+    for run in runs:
+        groups.setdefault((run["backend"], run["kind"]), []).append(run)
+
+    summary = []
+    for (backend, kind), group in sorted(groups.items()):
+        timed_runs = [run["timings"] for run in group if run["timings"]]
+        summary.append({
+            "backend": backend,
+            "kind": kind,
+            "runs": len(group),
+            "feasibility_rate": sum(run["feasible"] for run in group) / len(group),
+            "mean_cost": mean(run["cost"] for run in group),
+            "mean_vehicles_used": mean(run["vehicles_used"] for run in group),
+            "mean_wall_ms": mean(run["wall_ms"] for run in group),
+            "mean_stage_ms": {
+                "matrix": mean(t["matrix_ms"] for t in timed_runs),
+                "build": mean(t["build_ms"] for t in timed_runs),
+                "search": mean(sum(t["solve_ms"]) for t in timed_runs),
+                "geometry": mean(t["geometry_ms"] for t in timed_runs),
+                "serialization": mean(t["serialization_ms"] for t in timed_runs)
+            }
+        })
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_suite(args):
+    """
+    Suite de regresión: instancias sintéticas y Solomon/Homberger por el
+    pipeline completo de /solve con el motor local (red vial en cuadrícula
+    o --road-network) y con la matriz de respaldo; resultados en JSON.
+    """
+    depot = tuple(args.depot)
+    instances = []
+    for kind in args.kinds:
+        for n in args.sizes:
+            for seed in range(args.seeds):
+                rng = random.Random(seed)
+                orders = synthetic_orders(kind, n, rng, depot, args.radius, args.time_windows)
+                instances.append((f"{kind}-{n}-{seed}", kind, orders, args.capacity, n))
+    for path in args.solomon:
+        instance = load_solomon(path)
+        instances.append((instance["name"], "solomon", solomon_orders(instance, depot),
+                          instance["capacity"], instance["vehicles"]))
+
+    app.logger.setLevel(logging.ERROR)
+    client = app.app.test_client()
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        road_network = args.road_network
+        if "local" in args.backends and not road_network:
+            road_network = os.path.join(tmp, "grid.geojson")
+            street_grid(road_network, depot, args.radius)
+        routers = {
+            "local": lambda: app.LocalRouter(road_network),
+            "fallback": UnavailableRouter
+        }
+
+        print(f"{'instancia':>18} | {'motor':>8} | {'estado':>6} | {'costo':>9} | "
+              f"{'vehículos':>9} | {'matriz ms':>9} | {'búsqueda ms':>11} | {'total ms':>9}")
+        for backend in args.backends:
+            app.routing_backend = routers[backend]()
+            for name, kind, orders, capacity, vehicles in instances:
+                app.matrix_cache = app.MatrixCache()
+                run = run_solve(client, orders, capacity, vehicles, args.runtime)
+                run.update({"instance": name, "kind": kind, "backend": backend,
+                            "clients": len(orders) - 1})
+                runs.append(run)
+                timings = run["timings"] or {}
+                print(f"{name:>18} | {backend:>8} | {run['status']:>6} | {run['cost'] or '-':>9} | "
+                      f"{run['vehicles_used'] or '-':>9} | {timings.get('matrix_ms') or '-':>9} | "
+                      f"{sum(timings.get('solve_ms', [])) or '-':>11} | {run['wall_ms']:>9.0f}")
+
+    results = {
+        "meta": {
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "pyvrp": metadata.version("pyvrp"),
+            "args": vars(args)
+        },
+        "summary": summarize(runs),
+        "runs": runs
+    }
+    with open(args.output, "w") as fh:
+        json.dump(results, fh, indent=2)
+
+    print()
+    for row in results["summary"]:
+        print(f"{row['backend']:>8} {row['kind']:>9}: factibles {row['feasibility_rate']:.0%}, "
+              f"costo medio {row['mean_cost']}, vehículos {row['mean_vehicles_used']}, "
+              f"etapas (ms) {row['mean_stage_ms']}")
+    print(f"Resultados en {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="construcción de la instancia PyVRP")
+    build.add_argument("--sizes", type=int, nargs="+", default=[100, 300, 500])
+    build.add_argument("--repeat", type=int, default=3)
+
+    edges = sub.add_parser("edges", help="aristas por llamada frente a matrices NumPy")
+    edges.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000])
+    edges.add_argument("--repeat", type=int, default=3)
+
+    fallback = sub.add_parser("fallback", help="matriz de respaldo sin OSRM")
+    fallback.add_argument("--sizes", type=int, nargs="+", default=[500, 1000, 2000])
+    fallback.add_argument("--repeat", type=int, default=3)
+
+    sparse = sub.add_parser("sparse", help="calidad de la matriz dispersa de k vecinos")
+    sparse.add_argument("--sizes", type=int, nargs="+", default=[300, 1000])
+    sparse.add_argument("--neighbours", type=int, nargs="+", default=[10, 20, 40])
+    sparse.add_argument("--runtime", type=float, default=10)
+    sparse.add_argument("--seed", type=int, default=1)
+
+    logs = sub.add_parser("logging", help="latencia de /solve con registro INFO frente a DEBUG")
+    logs.add_argument("--sizes", type=int, nargs="+", default=[100, 300, 500])
+    logs.add_argument("--repeat", type=int, default=3)
+    logs.add_argument("--iterations", type=int, default=1)
+
+    suite = sub.add_parser("suite", help="suite de regresión de /solve con salida JSON")
+    suite.add_argument("--kinds", nargs="+", default=["uniform", "clustered", "mixed"],
+                       choices=["uniform", "clustered", "mixed"])
+    suite.add_argument("--sizes", type=int, nargs="+", default=[50, 100])
+    suite.add_argument("--seeds", type=int, default=2, help="instancias por tipo y tamaño")
+    suite.add_argument("--time-windows", choices=["wide", "varied"], default="varied")
+    suite.add_argument("--capacity", type=int, default=200)
+    suite.add_argument("--depot", type=float, nargs=2, default=list(DEPOT), metavar=("LON", "LAT"))
+    suite.add_argument("--radius", type=float, default=1500, help="metros alrededor del depósito")
+    suite.add_argument("--solomon", nargs="*", default=[], help="archivos Solomon/Homberger")
+    suite.add_argument("--backends", nargs="+", default=["local", "fallback"], choices=["local", "fallback"])
+    suite.add_argument("--road-network", help="GeoJSON para el motor local (por defecto una cuadrícula)")
+    suite.add_argument("--runtime", type=float, default=5, help="segundos de búsqueda por instancia")
+    suite.add_argument("--output", default="benchmark-results.json")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        bench_build(args.sizes, args.repeat)
+    elif args.command == "edges":
+        bench_edges(args.sizes, args.repeat)
+    elif args.command == "fallback":
+        bench_fallback(args.sizes, args.repeat)
+    elif args.command == "sparse":
+        bench_sparse(args.sizes, args.neighbours, args.runtime, args.seed)
+    elif args.command == "logging":
+        bench_logging(args.sizes, args.repeat, args.iterations)
+    elif args.command == "suite":
+        bench_suite(args)
+
+
+if __name__ == "__main__":
+    main()